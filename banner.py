@@ -1,7 +1,9 @@
-from BeautifulSoup import BeautifulSoup, NavigableString, Tag
+from BeautifulSoup import BeautifulSoup, NavigableString, SoupStrainer, Tag, UnicodeDammit
+from sgmllib import SGMLParser, SGMLParseError
 import mechanize
 import os
 import re
+import weakref
 
 def compare_semesters(a_name, b_name):
     '''
@@ -30,17 +32,11 @@ class Course:
         self.title = ''
         self.attributes = ''
         self.description = ''
-        self.semesters = []
+        self.semesters = _TrackedList()
 
     def get_semester(self, name):
         '''Returns the semester with the given name, creating it first if needed.'''
-        for semester in self.semesters:
-            if semester.name == name:
-                return semester
-        semester = Semester()
-        semester.name = name
-        self.semesters.append(semester)
-        return semester
+        return _get_semester(self, name, Semester)
 
 class Semester:
     '''Semester objects own Section objects and are owned by Course objects.'''
@@ -49,7 +45,11 @@ class Semester:
         self.name = ''
         self.exam_time = ''
         self.exam_date = ''
-        self.sections = []
+        self.sections = _TrackedList()
+
+    def get_section(self, crn):
+        '''Returns the section with the given CRN, or None if there isn't one.'''
+        return _get_section(self, crn)
 
 class Section:
     '''Section objects own Meeting objects and are owned by Semester objects.'''
@@ -62,7 +62,12 @@ class Section:
         self.meetings = []
 
 class Meeting:
-    '''Meeting objects are owned by Section objects.'''
+    '''
+    Meeting objects are owned by Section objects. The numeric fields are parsed
+    from the strings by set_meeting_times(): day_mask has a bit per day (see
+    DAY_BITS), start_time and end_time are minutes since midnight, and
+    start_date and end_date are date ordinals. They are 0 and -1 if unknown.
+    '''
 
     def __init__(self):
         self.type = ''
@@ -71,31 +76,331 @@ class Meeting:
         self.where = ''
         self.date_range = ''
         self.instructors = ''
+        self.day_mask = 0
+        self.start_time = -1
+        self.end_time = -1
+        self.start_date = -1
+        self.end_date = -1
+
+# The indices below live outside of the objects so they don't show up in the
+# output or in pickles. They map a key to the position of the item with that
+# key, and a hit is only trusted if that item is still at that position with
+# that key. An index is rebuilt when a hit fails that check or when the list was
+# replaced (like parse_semester() does) or changed since the index was built.
+# Changes are noticed through the version of a _TrackedList, which is what
+# Course and Semester objects start with, but for a plain list only through its
+# length, so a miss after editing a plain list in place may be stale.
+_semester_indices = weakref.WeakKeyDictionary()
+_section_indices = weakref.WeakKeyDictionary()
+
+class _TrackedList(list):
+    '''A list that counts its changes in version so indices know when to rebuild.'''
+
+    version = 0
+
+    def __reduce__(self):
+        return (_TrackedList, (list(self),))
+
+def _tracked(name):
+    method = getattr(list, name)
+    def wrapper(self, *args):
+        self.version += 1
+        return method(self, *args)
+    wrapper.__name__ = name
+    return wrapper
+
+for _name in ('__setitem__', '__delitem__', '__setslice__', '__delslice__', '__iadd__', '__imul__',
+        'append', 'extend', 'insert', 'pop', 'remove', 'reverse', 'sort'):
+    setattr(_TrackedList, _name, _tracked(_name))
+del _name
+
+def _list_stamp(items):
+    return len(items), getattr(items, 'version', None)
+
+def _list_find(indices, owner, items, key, value):
+    '''Returns an item with key(item) == value in the list items of owner, or None if there isn't one.'''
+    entry = indices.get(owner)
+    if entry is not None and entry[0] is items:
+        position = entry[2].get(value)
+        if position is not None:
+            if position < len(items) and key(items[position]) == value:
+                return items[position]
+        elif entry[1] == _list_stamp(items):
+            return None
+    index = dict((key(x), i) for i, x in reversed(list(enumerate(items))))
+    indices[owner] = (items, _list_stamp(items), index)
+    position = index.get(value)
+    return items[position] if position is not None else None
+
+def _semester_name(semester):
+    return semester.name
+
+def _find_semester(course, name):
+    return _list_find(_semester_indices, course, course.semesters, _semester_name, name)
+
+def _get_semester(course, name, semester_class):
+    semester = _find_semester(course, name)
+    if semester is None:
+        semester = semester_class()
+        semester.name = name
+        course.semesters.append(semester)
+        index = _semester_indices[course][2]
+        index[name] = len(course.semesters) - 1
+        _semester_indices[course] = (course.semesters, _list_stamp(course.semesters), index)
+    return semester
+
+def _get_section(semester, crn):
+    return _list_find(_section_indices, semester, semester.sections, lambda section: section.crn, crn)
+
+################################################################################
+# compact class structure
+################################################################################
+
+class _Compact(object):
+    '''
+    Base class of the compact versions of Course, Semester, Section and Meeting,
+    which store their attributes in __slots__ instead of a __dict__ per object.
+    The fields attribute lists the attributes in the order that the regular
+    classes set them, and tag is the name of the regular class in XML output.
+    '''
+    __slots__ = ()
+
+    def __getstate__(self):
+        return dict((x, getattr(self, x)) for x in self.fields if hasattr(self, x))
+
+    def __setstate__(self, state):
+        for x in state:
+            setattr(self, x, state[x])
+
+class CompactSemester(_Compact):
+    '''A Semester that takes less memory.'''
+    tag = 'semester'
+    fields = ('name', 'exam_time', 'exam_date', 'sections')
+    __slots__ = fields + ('__weakref__',)
+    __init__ = Semester.__init__.im_func
+
+    def get_section(self, crn):
+        '''Returns the section with the given CRN, or None if there isn't one.'''
+        return _get_section(self, crn)
+
+class CompactCourse(_Compact):
+    '''A Course that takes less memory.'''
+    tag = 'course'
+    fields = ('name', 'title', 'attributes', 'description', 'semesters')
+    __slots__ = fields + ('__weakref__',)
+    __init__ = Course.__init__.im_func
+
+    def get_semester(self, name):
+        '''Returns the semester with the given name, creating it first if needed.'''
+        return _get_semester(self, name, CompactSemester)
+
+class CompactSection(_Compact):
+    '''A Section that takes less memory.'''
+    tag = 'section'
+    __slots__ = fields = ('crn', 'levels', 'xlist_data', 'registration_dates', 'meetings')
+    __init__ = Section.__init__.im_func
+
+class CompactMeeting(_Compact):
+    '''A Meeting that takes less memory.'''
+    tag = 'meeting'
+    __slots__ = fields = ('type', 'days', 'time', 'where', 'date_range', 'instructors',
+        'day_mask', 'start_time', 'end_time', 'start_date', 'end_date')
+    __init__ = Meeting.__init__.im_func
+
+_COMPACT_CLASSES = { Course: CompactCourse, Semester: CompactSemester, Section: CompactSection, Meeting: CompactMeeting }
+
+def compact_courses(courses):
+    '''
+    Takes a list of Course objects and returns an equivalent list of CompactCourse
+    objects, which own CompactSemester, CompactSection and CompactMeeting objects.
+    '''
+    def convert(obj):
+        if isinstance(obj, list):
+            return type(obj)(convert(x) for x in obj)
+        compact_class = _COMPACT_CLASSES.get(obj.__class__)
+        if compact_class is None:
+            return obj
+        new_obj = compact_class.__new__(compact_class)
+        for x in compact_class.fields:
+            setattr(new_obj, x, convert(getattr(obj, x)))
+        return new_obj
+    return convert(courses)
+
+# returns the attributes to output for a Course, Semester, Section or Meeting
+def _fields(obj):
+    if isinstance(obj, _Compact):
+        return dict((x, getattr(obj, x)) for x in obj.fields)
+    return obj.__dict__
+
+# returns the XML element name for a Course, Semester, Section or Meeting
+def _tag(obj):
+    if isinstance(obj, _Compact):
+        return obj.tag
+    return obj.__class__.__name__.lower()
+
+################################################################################
+# interning
+################################################################################
+
+# fields that only take a small set of distinct values across all objects
+INTERNED_FIELDS = {
+    'section': ('levels', 'registration_dates'),
+    'meeting': ('type', 'days', 'time', 'where', 'date_range', 'instructors'),
+}
+
+class InternTable:
+    '''
+    Makes equal field values share one string object and keeps track of the
+    distinct values of each field.
+    '''
+
+    def __init__(self):
+        self.strings = {}
+        self.fields = {}
+
+    def intern(self, field, value):
+        '''Returns the shared object equal to value, recording it as a value of field.'''
+        shared = self.strings.setdefault(value, value)
+        if shared.__class__ is not value.__class__:
+            return value # don't turn u'x' into 'x' or the other way around
+        self.fields.setdefault(field, set()).add(shared)
+        return shared
+
+    def report(self):
+        '''Returns a dict from field name (like "meeting.where") to its number of distinct values.'''
+        return dict((field, len(values)) for field, values in self.fields.items())
+
+# the table that parse_semester(), courses_from_json() and intern_courses() use by default
+intern_table = InternTable()
+
+def intern_courses(courses, table=None):
+    '''
+    Makes the values of INTERNED_FIELDS in a list of Course objects share one
+    object per distinct value in table (intern_table if not given), which saves
+    memory and makes pickles smaller. Returns the list of courses.
+    '''
+    table = table or intern_table
+    for course in courses:
+        for semester in course.semesters:
+            for section in semester.sections:
+                _intern_section(section, table)
+    return courses
+
+def _intern_section(section, table):
+    for x in INTERNED_FIELDS['section']:
+        setattr(section, x, table.intern('section.' + x, getattr(section, x)))
+    for meeting in section.meetings:
+        for x in INTERNED_FIELDS['meeting']:
+            setattr(meeting, x, table.intern('meeting.' + x, getattr(meeting, x)))
+
+################################################################################
+# meeting times
+################################################################################
+
+# the bit for each letter of Meeting.days in a day bitmask, Monday is bit 0
+DAY_BITS = { 'M': 1, 'T': 2, 'W': 4, 'R': 8, 'F': 16, 'S': 32, 'U': 64 }
+
+TIME_REGEX = r'(\d+):(\d+)\s*([ap]m)\s*-\s*(\d+):(\d+)\s*([ap]m)'
+
+def _parse_days(days):
+    '''Returns the day bitmask for a Meeting.days string like "MWF", or 0 for "TBA".'''
+    mask = 0
+    for letter in days.strip():
+        if letter not in DAY_BITS:
+            return 0
+        mask |= DAY_BITS[letter]
+    return mask
+
+def _parse_time(time):
+    '''
+    Returns the start and end of a Meeting.time string like "10:00 am - 10:50 am"
+    in minutes since midnight, or (-1, -1) for "TBA".
+    '''
+    match = re.match(TIME_REGEX, time.strip().lower())
+    if not match:
+        return -1, -1
+    minutes = lambda hour, minute, am_pm: int(hour) % 12 * 60 + int(minute) + (720 if am_pm == 'pm' else 0)
+    return minutes(*match.group(1, 2, 3)), minutes(*match.group(4, 5, 6))
+
+def _parse_date_range(date_range):
+    '''
+    Returns the first and last day of a Meeting.date_range string like
+    "Sep 07, 2011 - Dec 21, 2011" as date ordinals, or (-1, -1) if it's not
+    in that format.
+    '''
+    import datetime
+    try:
+        start, end = date_range.split(' - ')
+        day = lambda text: datetime.datetime.strptime(text.strip(), '%b %d, %Y').toordinal()
+        return day(start), day(end)
+    except ValueError:
+        return -1, -1
+
+def _set_meeting_times(meeting):
+    meeting.day_mask = _parse_days(meeting.days)
+    meeting.start_time, meeting.end_time = _parse_time(meeting.time)
+    meeting.start_date, meeting.end_date = _parse_date_range(meeting.date_range)
+
+def set_meeting_times(courses):
+    '''
+    Sets the numeric fields of every Meeting in a list of Course objects from its
+    days, time and date_range strings. parse_semester() and courses_from_json()
+    already do this, so it's only needed for courses pickled before those fields
+    existed. Returns the list of courses.
+    '''
+    for course in courses:
+        for semester in course.semesters:
+            for section in semester.sections:
+                for meeting in section.meetings:
+                    _set_meeting_times(meeting)
+    return courses
 
 ################################################################################
 # xml output
 ################################################################################
 
-def _courses_to_xml_helper(doc, parent, obj, name):
-    element = doc.createElement(name)
-    parent.appendChild(element)
+# the output is exactly what xml.dom.minidom's toxml() used to produce
+def _courses_to_xml_helper(obj, name):
     if isinstance(obj, int) or isinstance(obj, float):
         obj = str(obj)
     if isinstance(obj, basestring):
-        element.appendChild(doc.createTextNode(obj))
-    elif isinstance(obj, list):
-        for x in obj:
-            _courses_to_xml_helper(doc, element, x, x.__class__.__name__.lower())
+        yield '<%s>' % name
+        yield obj.replace('&', '&amp;').replace('<', '&lt;').replace('"', '&quot;').replace('>', '&gt;')
+        yield '</%s>' % name
+        return
+    if isinstance(obj, list):
+        children = [(x, _tag(x)) for x in obj]
     else:
-        for x in obj.__dict__:
-            _courses_to_xml_helper(doc, element, obj.__dict__[x], x)
+        fields = _fields(obj)
+        children = [(fields[x], x) for x in fields]
+    if not children:
+        yield '<%s/>' % name
+        return
+    yield '<%s>' % name
+    for child, child_name in children:
+        for text in _courses_to_xml_helper(child, child_name):
+            yield text
+    yield '</%s>' % name
+
+def write_courses_xml(courses, file, encoding=None):
+    '''
+    Takes a list of Course objects and writes the courses_to_xml() string to
+    file as it goes, encoded with encoding if given.
+    '''
+    import itertools
+    texts = itertools.chain(['<?xml version="1.0" ?>'], _courses_to_xml_helper(courses, 'courses'))
+    while True:
+        text = ''.join(itertools.islice(texts, 4096))
+        if not text:
+            break
+        file.write(text.encode(encoding) if encoding else text)
 
 def courses_to_xml(courses):
     '''Takes a list of Course objects and returns an XML string.'''
-    import xml.dom.minidom as xml
-    doc = xml.Document()
-    _courses_to_xml_helper(doc, doc, courses, 'courses')
-    return doc.toxml()
+    import StringIO
+    output = StringIO.StringIO()
+    write_courses_xml(courses, output)
+    return output.getvalue()
 
 ################################################################################
 # json output
@@ -107,12 +412,325 @@ def _courses_to_json_helper(obj):
     elif isinstance(obj, list):
         return [_courses_to_json_helper(x) for x in obj]
     else:
-        return dict((x, _courses_to_json_helper(obj.__dict__[x])) for x in obj.__dict__)
+        fields = _fields(obj)
+        return dict((x, _courses_to_json_helper(fields[x])) for x in fields)
+
+def write_courses_json(courses, file, sort_keys=False):
+    '''
+    Takes a list (or any iterable) of Course objects and writes the
+    courses_to_json() string to file as it goes. The output is ASCII, so it
+    needs no encoding.
+    '''
+    import json
+    if not hasattr(courses, '__iter__'):
+        file.write(json.dumps(_courses_to_json_helper(courses), sort_keys=sort_keys))
+        return
+
+    # one course at a time keeps only that course's dicts and string in memory
+    file.write('[')
+    for i, course in enumerate(courses):
+        if i:
+            file.write(', ')
+        file.write(json.dumps(_courses_to_json_helper(course), sort_keys=sort_keys))
+    file.write(']')
+
+def courses_to_json(courses, sort_keys=False):
+    '''
+    Takes a list of Course objects and returns a JSON string, with the keys of
+    each object sorted if sort_keys is True so the output can be compared.
+    '''
+    import StringIO
+    output = StringIO.StringIO()
+    write_courses_json(courses, output, sort_keys)
+    return output.getvalue()
 
-def courses_to_json(courses):
-    '''Takes a list of Course objects and returns a JSON string.'''
+def _write_json_lines_shard(args):
+    '''Writes one file for export_json_lines() and returns its manifest entry.'''
+    import json
+    directory, entry, items, sort_keys = args
+    output = open(os.path.join(directory, entry['path']), 'wb')
+    entry['offsets'] = []
+    offset = 0
+    for course, semester in items:
+        if semester is None:
+            data = _courses_to_json_helper(course)
+        else:
+            # only the one semester is serialized, not every semester of the course
+            fields = dict(_fields(course))
+            fields['semesters'] = [semester]
+            data = dict((x, _courses_to_json_helper(fields[x])) for x in fields)
+        line = json.dumps(data, sort_keys=sort_keys) + '\n'
+        output.write(line)
+        entry['offsets'].append([course.name, offset])
+        offset += len(line)
+    output.close()
+    entry['count'] = len(items)
+    entry['bytes'] = offset
+    return entry
+
+def export_json_lines(courses, directory, by_department=True, by_semester=False, jobs=1, sort_keys=False):
+    '''
+    Writes a list of Course objects to JSON Lines files in directory, one course
+    per line in the format of courses_to_json(). With by_department=True there
+    is a file per department like "CSCI.jsonl", and with by_semester=True every
+    course is split into a line per semester with only that semester in
+    files like "Fall 2011/CSCI.jsonl" (or "Fall 2011.jsonl"), which leaves out
+    courses without semesters. Otherwise everything goes in "courses.jsonl".
+    The files are written by a pool of that many processes if jobs > 1.
+
+    Also writes directory/manifest.json, which lists every file with its path,
+    department and semester (if split by them), number of courses, size in
+    bytes and the [course name, byte offset] of each line, and returns it.
+    '''
+    import json
+    shards = {}
+    for course in courses:
+        department = course.name.split(' ')[0] if by_department else None
+        for semester in course.semesters if by_semester else [None]:
+            key = (semester and semester.name, department)
+            shards.setdefault(key, []).append((course, semester))
+
+    tasks = []
+    for (semester_name, department), items in sorted(shards.items()):
+        parts = [x for x in (semester_name, department) if x is not None] or ['courses']
+        entry = { 'path': '/'.join(parts) + '.jsonl' }
+        if by_semester:
+            entry['semester'] = semester_name
+        if by_department:
+            entry['department'] = department
+        if not os.path.exists(os.path.join(directory, *parts[:-1])):
+            os.makedirs(os.path.join(directory, *parts[:-1]))
+        tasks.append((directory, entry, items, sort_keys))
+
+    pool = None
+    if jobs > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs)
+    try:
+        manifest = { 'shards': (pool.map if pool else map)(_write_json_lines_shard, tasks) }
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+    _save(os.path.join(directory, 'manifest.json'), json.dumps(manifest, sort_keys=True))
+    return manifest
+
+def courses_from_json(text, compact=False, table=None):
+    '''
+    Takes a JSON string from courses_to_json() and returns the list of Course
+    (or CompactCourse) objects, with the repeated field values interned in table
+    (intern_table if not given). The numeric meeting fields are parsed again so
+    that JSON written before they existed still loads.
+    '''
     import json
-    return json.dumps(_courses_to_json_helper(courses))
+    classes = { 'semesters': Semester, 'sections': Section, 'meetings': Meeting }
+    if compact:
+        classes = dict((x, _COMPACT_CLASSES[classes[x]]) for x in classes)
+
+    def convert(obj, obj_class):
+        # create the object first so the attributes are set in the usual order
+        new_obj = obj_class()
+        for x in obj:
+            value = obj[x]
+            if x in classes:
+                value = _TrackedList(convert(item, classes[x]) for item in value)
+            setattr(new_obj, x, value)
+        return new_obj
+
+    courses = [convert(x, CompactCourse if compact else Course) for x in json.loads(text)]
+    return intern_courses(set_meeting_times(courses), table)
+
+################################################################################
+# binary snapshots
+################################################################################
+
+# A snapshot is a header followed by tables of little-endian records, where
+# strings are ids into the string table and each course, semester and section
+# refers to its children by the index of the first one and their count:
+#
+#   string offsets   one uint32 per string plus one for the end of the last
+#   string data      the UTF-8 bytes of every distinct string
+#   courses          name, title, attributes, description, first, count
+#   semesters        name, exam_time, exam_date, first, count
+#   sections         crn, levels, xlist_data, registration_dates, first, count
+#   meetings         type, days, time, where, date_range, instructors,
+#                    day_mask, start_time, end_time, start_date, end_date
+#   name index       course indices sorted by the UTF-8 bytes of the name
+#   crn index        crn, course, semester, section, sorted
+SNAPSHOT_MAGIC = 'BNRS'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_TABLES = ['string_offsets', 'strings', 'courses', 'semesters', 'sections', 'meetings', 'names', 'crns']
+SNAPSHOT_HEADER = '<4sI' + 'II' * len(SNAPSHOT_TABLES)
+SNAPSHOT_RECORDS = {
+    'string_offsets': '<I',
+    'strings': '<c',
+    'courses': '<6I',
+    'semesters': '<5I',
+    'sections': '<i5I',
+    'meetings': '<6IBhhii',
+    'names': '<I',
+    'crns': '<i3I',
+}
+
+def write_snapshot(courses, path):
+    '''Takes a list of Course objects and writes them to a snapshot file that Snapshot can open.'''
+    import struct
+    ids = {}
+    strings = []
+    tables = dict((x, []) for x in SNAPSHOT_TABLES)
+
+    def string(value):
+        if isinstance(value, unicode):
+            value = value.encode('utf8')
+        if value not in ids:
+            ids[value] = len(strings)
+            strings.append(value)
+        return ids[value]
+
+    for course in courses:
+        tables['courses'].append((string(course.name), string(course.title), string(course.attributes),
+            string(course.description), len(tables['semesters']), len(course.semesters)))
+        for semester in course.semesters:
+            tables['semesters'].append((string(semester.name), string(semester.exam_time),
+                string(semester.exam_date), len(tables['sections']), len(semester.sections)))
+            for section in semester.sections:
+                tables['crns'].append((section.crn, len(tables['courses']) - 1,
+                    len(tables['semesters']) - 1, len(tables['sections'])))
+                tables['sections'].append((section.crn, string(section.levels), string(section.xlist_data),
+                    string(section.registration_dates), len(tables['meetings']), len(section.meetings)))
+                for m in section.meetings:
+                    tables['meetings'].append((string(m.type), string(m.days), string(m.time), string(m.where),
+                        string(m.date_range), string(m.instructors), m.day_mask, m.start_time, m.end_time,
+                        m.start_date, m.end_date))
+    names = [string(course.name) for course in courses]
+    tables['names'] = [(i,) for i in sorted(range(len(courses)), key=lambda i: strings[names[i]])]
+    tables['crns'].sort()
+    offsets = [0]
+    for value in strings:
+        offsets.append(offsets[-1] + len(value))
+    tables['string_offsets'] = [(x,) for x in offsets]
+
+    chunks = []
+    header = [SNAPSHOT_MAGIC, SNAPSHOT_VERSION]
+    offset = struct.calcsize(SNAPSHOT_HEADER)
+    for name in SNAPSHOT_TABLES:
+        record = struct.Struct(SNAPSHOT_RECORDS[name])
+        if name == 'strings':
+            chunks.append(''.join(strings))
+        else:
+            chunks.append(''.join(record.pack(*x) for x in tables[name]))
+        header += [offset, len(chunks[-1]) / record.size]
+        offset += len(chunks[-1])
+    _save(path, struct.pack(SNAPSHOT_HEADER, *header) + ''.join(chunks))
+
+class Snapshot:
+    '''
+    A snapshot file from write_snapshot() opened with mmap, so that opening it
+    doesn't read anything but the header and looking up a course only reads and
+    decodes the records of that course. Strings come back as unicode.
+    '''
+
+    def __init__(self, path):
+        import mmap, struct
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = struct.unpack_from(SNAPSHOT_HEADER, self.data)
+        if header[0] != SNAPSHOT_MAGIC or header[1] != SNAPSHOT_VERSION:
+            raise ValueError('%s is not a version %d snapshot' % (path, SNAPSHOT_VERSION))
+        self.tables = {}
+        for i, name in enumerate(SNAPSHOT_TABLES):
+            self.tables[name] = (header[2 + i * 2], header[3 + i * 2], struct.Struct(SNAPSHOT_RECORDS[name]))
+        self.strings = {}
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __len__(self):
+        return self.tables['courses'][1]
+
+    def _record(self, table, index):
+        offset, count, record = self.tables[table]
+        return record.unpack_from(self.data, offset + index * record.size)
+
+    def _bytes(self, index):
+        start, end = self._record('string_offsets', index)[0], self._record('string_offsets', index + 1)[0]
+        offset = self.tables['strings'][0]
+        return self.data[offset + start:offset + end]
+
+    def _string(self, index):
+        if index not in self.strings:
+            self.strings[index] = self._bytes(index).decode('utf8')
+        return self.strings[index]
+
+    def _lower_bound(self, table, key, value):
+        low, high = 0, self.tables[table][1]
+        while low < high:
+            middle = (low + high) / 2
+            if key(self._record(table, middle)) < value:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _course(self, index):
+        name, title, attributes, description, first, count = self._record('courses', index)
+        course = Course()
+        course.name, course.title = self._string(name), self._string(title)
+        course.attributes, course.description = self._string(attributes), self._string(description)
+        for i in range(first, first + count):
+            course.semesters.append(self._semester(i))
+        return course
+
+    def _semester(self, index):
+        name, exam_time, exam_date, first, count = self._record('semesters', index)
+        semester = Semester()
+        semester.name, semester.exam_time, semester.exam_date = map(self._string, (name, exam_time, exam_date))
+        for i in range(first, first + count):
+            semester.sections.append(self._section(i))
+        return semester
+
+    def _section(self, index):
+        crn, levels, xlist_data, registration_dates, first, count = self._record('sections', index)
+        section = Section()
+        section.crn = crn
+        section.levels, section.xlist_data, section.registration_dates = \
+            map(self._string, (levels, xlist_data, registration_dates))
+        for i in range(first, first + count):
+            record = self._record('meetings', i)
+            meeting = Meeting()
+            meeting.type, meeting.days, meeting.time, meeting.where, meeting.date_range, meeting.instructors = \
+                map(self._string, record[:6])
+            meeting.day_mask, meeting.start_time, meeting.end_time, meeting.start_date, meeting.end_date = record[6:]
+            section.meetings.append(meeting)
+        return section
+
+    def course(self, name):
+        '''Returns the Course with the given name, or None if there isn't one.'''
+        if isinstance(name, unicode):
+            name = name.encode('utf8')
+        course_name = lambda record: self._bytes(self._record('courses', record[0])[0])
+        i = self._lower_bound('names', course_name, name)
+        if i < len(self) and course_name(self._record('names', i)) == name:
+            return self._course(self._record('names', i)[0])
+        return None
+
+    def sections(self, crn):
+        '''Returns a (Course, Semester, Section) tuple for each semester with a section with the given CRN.'''
+        result = []
+        i = self._lower_bound('crns', lambda record: record[0], crn)
+        while i < self.tables['crns'][1] and self._record('crns', i)[0] == crn:
+            crn, course_index, semester_index, section_index = self._record('crns', i)
+            course = self._course(course_index)
+            semester = course.semesters[semester_index - self._record('courses', course_index)[4]]
+            section = semester.sections[section_index - self._record('semesters', semester_index)[3]]
+            result.append((course, semester, section))
+            i += 1
+        return result
+
+    def courses(self):
+        '''Returns every Course in the snapshot in the order they were written.'''
+        return [self._course(i) for i in range(len(self))]
 
 ################################################################################
 # downloading
@@ -134,6 +752,7 @@ CATALOG_DATA_PATH = CACHE_DIR + '/%s/catalog/'
 EXAM_LINK_REGEX = r'.*Display_Exam'
 EXAM_DATA_PATH = CACHE_DIR + '/%s/exam times/'
 BAD_EXAM_INFO = 'Only the Primary Meeting of a course has scheduled exam information'
+MANIFEST_PATH = CACHE_DIR + '/%s/manifest'
 
 def _save(path, data):
     '''Saves data in the given path after creating directories as needed.'''
@@ -143,8 +762,114 @@ def _save(path, data):
         pass
     open(path, 'w').write(data)
 
-def _download_semester_helper(semester, start_url, path_template):
-    # open the main schedule page
+class _Manifest:
+    '''
+    Records every page fetched for a semester with its status and timestamp so
+    an interrupted download can be resumed. Keys look like "schedule/CSCI",
+    "catalog/CSCI", "section/12345" and "exam/CSCI 0150". The manifest is a log
+    with one JSON entry per line, later entries for a key replace earlier ones.
+
+    Saved pages also record a content hash and the ETag and Last-Modified
+    headers the server sent, so that an incremental download can make
+    conditional requests and tell which files actually changed.
+    '''
+
+    def __init__(self, semester, resume=False, max_age=None, incremental=False):
+        import json, threading
+        self.path = MANIFEST_PATH % semester
+        self.resume = resume
+        self.max_age = max_age
+        self.incremental = incremental
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.changed = []
+        try:
+            for line in open(self.path):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue # a run that died while writing the last line
+                self.entries[entry['key']] = entry
+        except IOError:
+            pass
+
+        # compact the log so it doesn't grow with every run
+        _save(self.path, ''.join(json.dumps(entry) + '\n' for entry in self.entries.values()))
+
+    def done(self, key):
+        '''
+        Returns True if resuming and key was fetched, isn't older than max_age
+        seconds, and the file it was saved to (if any) still exists.
+        '''
+        import time
+        entry = self.entries.get(key)
+        if not self.resume or entry is None or entry['status'] != 'done':
+            return False
+        if self.max_age is not None and time.time() - entry['time'] > self.max_age:
+            return False
+        return entry.get('path') is None or os.path.exists(entry['path'])
+
+    def names(self, kind):
+        '''Returns the names of the done keys of the given kind (e.g. "exam").'''
+        prefix = kind + '/'
+        return set(key[len(prefix):] for key in self.entries if key.startswith(prefix) and self.done(key))
+
+    def conditional_headers(self, key):
+        '''
+        Returns the headers for a conditional request of the page for key when
+        downloading incrementally and the previously saved page still exists.
+        '''
+        entry = self.entries.get(key)
+        headers = {}
+        if self.incremental and entry is not None and os.path.exists(entry.get('path', '')):
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def save(self, key, path, data, headers=None):
+        '''
+        Saves the page for key in path and records it. When downloading
+        incrementally, the file is only rewritten if its content changed. Returns
+        True if the content changed since the last download.
+        '''
+        import hashlib
+        digest = hashlib.sha1(data).hexdigest()
+        entry = self.entries.get(key)
+        changed = entry is None or entry.get('hash') != digest or not os.path.exists(path)
+        if changed or not self.incremental:
+            _save(path, data)
+        if changed:
+            with self.lock:
+                self.changed.append(path)
+        # a 304 doesn't have to repeat the validators, so keep the ones we had
+        headers = headers or {}
+        etag, last_modified = headers.get('ETag'), headers.get('Last-Modified')
+        if not changed:
+            etag = etag or entry.get('etag')
+            last_modified = last_modified or entry.get('last_modified')
+        self.mark(key, path, hash=digest, etag=etag, last_modified=last_modified)
+        return changed
+
+    def mark(self, key, path=None, status='done', **fields):
+        '''Records that key was fetched (and saved to path if given).'''
+        import json, time
+        entry = { 'key': key, 'status': status, 'time': time.time() }
+        if path is not None:
+            entry['path'] = path
+        entry.update((name, value) for name, value in fields.items() if value is not None)
+        with self.lock:
+            self.entries[key] = entry
+            f = open(self.path, 'a')
+            f.write(json.dumps(entry) + '\n')
+            f.close()
+
+def _open_semester(semester, start_url):
+    '''
+    Returns a mechanize.Browser that has opened start_url and selected the
+    semester, so that the first form on the current page lists the departments.
+    '''
     b = mechanize.Browser()
     b.set_handle_robots(False)
     b.open(start_url)
@@ -162,67 +887,483 @@ def _download_semester_helper(semester, start_url, path_template):
         import sys
         sys.exit()
     b.submit()
+    return b
 
-    # get the list of department codes
+def _department_key(path_template, department_code):
+    '''Returns the manifest key for a department page, like "schedule/CSCI".'''
+    return path_template.split('/')[-2] + '/' + department_code
+
+def _download_department(b, semester, path_template, department_code, manifest):
+    '''Downloads one department page using a browser from _open_semester().'''
+    b.select_form(nr=0)
+    b.find_control(type='select', nr=0).get(department_code).selected = True
+    b.submit()
+    html = b.response().read()
+    path = (path_template % semester) + department_code + '.html'
+    manifest.save(_department_key(path_template, department_code), path, html, b.response().info())
+    b.back()
+
+def _run_threads(targets):
+    '''
+    Calls each function in targets on its own thread and waits for all of them,
+    then raises the first exception that any of them raised, like calling them
+    one after another would have.
+    '''
+    import sys, threading
+    errors = []
+
+    def run(target):
+        try:
+            target()
+        except Exception:
+            errors.append(sys.exc_info())
+
+    threads = [threading.Thread(target=run, args=(target,)) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+
+def _download_semester_helper(semester, start_url, path_template, manifest, workers=1):
+    b = _open_semester(semester, start_url)
+
+    # get the list of department codes, skipping the ones already downloaded
     b.select_form(nr=0)
-    department_codes = map(str, b.find_control(type='select', nr=0).items)
+    department_codes = [department_code for department_code in map(str, b.find_control(type='select', nr=0).items)
+        if not manifest.done(_department_key(path_template, department_code))]
 
     # download each department schedule
-    for i, department_code in enumerate(department_codes):
-        b.select_form(nr=0)
-        b.find_control(type='select', nr=0).get(department_code).selected = True
-        b.submit()
-        html = b.response().read()
-        _save((path_template % semester) + department_code + '.html', html)
-        b.back()
-        print 'downloaded department %s, %.2f%% done' % (department_code,
-            100.0 * (i + 1) / len(department_codes))
-
-def _download_exam_times(semester):
+    if workers <= 1:
+        for i, department_code in enumerate(department_codes):
+            _download_department(b, semester, path_template, department_code, manifest)
+            print 'downloaded department %s, %.2f%% done' % (department_code,
+                100.0 * (i + 1) / len(department_codes))
+        return
+
+    # each worker owns a browser session and pulls department codes off a
+    # shared queue, the first worker reuses the session opened above
+    import functools, threading, Queue
+    queue = Queue.Queue()
+    for department_code in department_codes:
+        queue.put(department_code)
+    lock = threading.Lock()
+    done = [0]
+
+    def worker(b):
+        if b is None:
+            b = _open_semester(semester, start_url)
+        while True:
+            try:
+                department_code = queue.get_nowait()
+            except Queue.Empty:
+                return
+            _download_department(b, semester, path_template, department_code, manifest)
+            with lock:
+                done[0] += 1
+                print 'downloaded department %s, %.2f%% done' % (department_code,
+                    100.0 * done[0] / len(department_codes))
+
+    _run_threads([functools.partial(worker, b if i == 0 else None) for i in range(min(workers, len(department_codes)))])
+
+class _BrowserPool:
+    '''
+    A pool of mechanize.Browser objects so that connections and cookies are
+    reused across requests instead of creating a new session for every page.
+    '''
+
+    def __init__(self):
+        import threading
+        self.lock = threading.Lock()
+        self.browsers = []
+
+    def get(self):
+        with self.lock:
+            if self.browsers:
+                return self.browsers.pop()
+        b = mechanize.Browser()
+        b.set_handle_robots(False)
+        return b
+
+    def put(self, b):
+        # the history keeps every page visited, which adds up over a semester
+        b.clear_history()
+        with self.lock:
+            self.browsers.append(b)
+
+def _download_exam_time(pool, semester, crn, href, name, manifest):
+    '''
+    Follows the exam link on the section detail page at href and saves it if it
+    has exam info. Returns True if the exam page for the course was saved.
+    '''
+    key = 'exam/' + name
+    path = (EXAM_DATA_PATH % semester) + name + '.html'
+    b = pool.get()
+    try:
+        b.open(href)
+        for link in list(b.links(url_regex=re.compile(EXAM_LINK_REGEX))):
+            try:
+                b.open(mechanize.Request(link.absolute_url, headers=manifest.conditional_headers(key)))
+                html = b.response().read()
+                headers = b.response().info()
+            except mechanize.HTTPError, e:
+                if e.code != 304:
+                    raise
+                html = open(path).read() # not modified since the last download
+                headers = e.info()
+            finally:
+                b.back()
+            if 'Exam Date' in html and 'Exam Time' in html:
+                manifest.save(key, path, html, headers)
+                manifest.mark('section/' + crn)
+                print 'saved exam time for %s' % name
+                return True
+        manifest.mark('section/' + crn)
+        return False
+    finally:
+        pool.put(b)
+
+def _download_exam_times(semester, manifest, workers=1):
     directory = SCHEDULE_DATA_PATH % semester
     filenames = os.listdir(directory)
 
+    # exam info is per course and not per section, so a course is resolved
+    # once any of its sections has led to an exam page
+    pool = _BrowserPool()
+    resolved = manifest.names('exam')
+
     for i, filename in enumerate(filenames):
         if not filename.endswith('.html'):
             continue
 
         data = open(directory + filename).read()
         soup = BeautifulSoup(data)
+        sections = []
         for link in soup.findAll(href=re.compile(SCHEDULE_LINK_REGEX)):
             title, crn, name, index = link.text.rsplit('-', 3)
-            href = BASE_URL + link['href']
+            crn = crn.strip()
+            if not manifest.done('section/' + crn):
+                sections.append((crn, BASE_URL + link['href'], name.strip()))
+
+        if workers <= 1:
+            for crn, href, name in sections:
+                if name not in resolved and _download_exam_time(pool, semester, crn, href, name, manifest):
+                    resolved.add(name)
+        else:
+            # sections of the same course are tried in order by one worker so
+            # later sections are only fetched if the earlier ones had no exam
+            import Queue
+            queue = Queue.Queue()
+            by_name = {}
+            for crn, href, name in sections:
+                if name not in resolved:
+                    if name not in by_name:
+                        queue.put(name)
+                    by_name.setdefault(name, []).append((crn, href))
+
+            def worker():
+                while True:
+                    try:
+                        name = queue.get_nowait()
+                    except Queue.Empty:
+                        return
+                    for crn, href in by_name[name]:
+                        if _download_exam_time(pool, semester, crn, href, name, manifest):
+                            resolved.add(name)
+                            break
+
+            _run_threads([worker] * workers)
 
-            b = mechanize.Browser()
-            b.set_handle_robots(False)
-            b.open(href)
+        print 'parsed %s, %.2f%% done' % (filename, 100.0 * (i + 1) / len(filenames))
 
-            name = name.strip()
-            for link in b.links(url_regex=re.compile(EXAM_LINK_REGEX)):
-                b.follow_link(link)
-                html = b.response().read()
-                b.back()
-                if 'Exam Date' in html and 'Exam Time' in html:
-                    _save((EXAM_DATA_PATH % semester) + name + '.html', html)
-                    print 'saved exam time for %s' % name
-                    break
+class _Crawler:
+    '''
+    A crawl engine that keeps up to max_in_flight requests going at once. Requests
+    are pulled off a frontier, new requests discovered by the callbacks are added
+    back to it, and every request shares a single cookie jar. The urls of
+    requests that failed are kept in failures.
+    '''
 
-        print 'parsed %s, %.2f%% done' % (filename, 100.0 * (i + 1) / len(filenames))
+    def __init__(self, max_in_flight=8):
+        import cookielib, threading, Queue, urllib2
+        self.opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(cookielib.CookieJar()))
+        self.max_in_flight = max_in_flight
+        self.frontier = Queue.Queue()
+        self.lock = threading.Lock()
+        self.seen = set()
+        self.failures = []
+
+    def fetch(self, url, fields=None, headers={}):
+        '''
+        Fetches url, POSTing the list of (name, value) pairs in fields if given.
+        Returns the final url, the html and the headers of the response. The html
+        is None if the response to a conditional request was 304 Not Modified.
+        '''
+        import urllib, urllib2
+        data = urllib.urlencode(fields) if fields is not None else None
+        try:
+            response = self.opener.open(urllib2.Request(url, data, headers))
+        except urllib2.HTTPError, e:
+            if e.code != 304:
+                raise
+            return url, None, e.info()
+        try:
+            return response.geturl(), response.read(), response.info()
+        finally:
+            response.close()
+
+    def add(self, url, fields, callback, headers={}, errback=None):
+        '''
+        Adds a request to the frontier, callback(url, html, headers) is called
+        with the response. If fetching or the callback fails, errback() is called
+        instead (if given) so that whatever was waiting on the request can carry
+        on. Returns False if the same request was already added.
+        '''
+        key = (url, tuple(fields) if fields is not None else None)
+        with self.lock:
+            if key in self.seen:
+                return False
+            self.seen.add(key)
+        self.frontier.put((url, fields, headers, callback, errback))
+        return True
+
+    def run(self):
+        '''Processes the frontier until it is empty and nothing is in flight.'''
+        import threading
+
+        def worker():
+            while True:
+                item = self.frontier.get()
+                if item is None:
+                    return
+                url, fields, headers, callback, errback = item
+                try:
+                    callback(*self.fetch(url, fields, headers))
+                except Exception, e:
+                    print 'error: could not crawl %s (%s)' % (url, e)
+                    with self.lock:
+                        self.failures.append(url)
+                    if errback:
+                        try:
+                            errback()
+                        except Exception, e:
+                            print 'error: could not recover from failing to crawl %s (%s)' % (url, e)
+                finally:
+                    self.frontier.task_done()
+
+        threads = [threading.Thread(target=worker) for x in range(self.max_in_flight)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        self.frontier.join()
+        for thread in threads:
+            self.frontier.put(None)
+        for thread in threads:
+            thread.join()
+
+def _form_options(html):
+    '''Returns the (value, label) pairs of the first <select> in the first form in html.'''
+    select = BeautifulSoup(html).find('form').find('select')
+    return [(option.get('value', _to_str(option)), _to_str(option)) for option in select.findAll('option')]
+
+def _form_request(html, url, value):
+    '''
+    Fills out the first form in html like mechanize would, with value selected in
+    the first <select> and every other control left at its default. Returns the
+    action url and the list of (name, value) pairs to POST.
+    '''
+    import urlparse
+    form = BeautifulSoup(html).find('form')
+    fields = []
+    first = True
+    for control in form.findAll(['input', 'select', 'textarea']):
+        name = control.get('name')
+        if not name:
+            continue
+        if control.name == 'select':
+            if first:
+                first = False
+                fields.append((name, value))
+                continue
+            options = control.findAll('option')
+            values = [option.get('value', _to_str(option)) for option in options]
+            selected = [v for v, option in zip(values, options) if option.get('selected') is not None]
+            if not selected and values and control.get('multiple') is None:
+                selected = values[:1]
+            fields.extend((name, v) for v in selected)
+        elif control.name == 'textarea':
+            fields.append((name, _to_str(control)))
+        else:
+            kind = control.get('type', 'text').lower()
+            if kind in ('checkbox', 'radio') and control.get('checked') is None:
+                continue
+            if kind in ('submit', 'reset', 'button', 'image'):
+                continue
+            fields.append((name, control.get('value', '')))
+    return urlparse.urljoin(url, form.get('action', url)), fields
+
+def _crawl_exam_times(crawler, semester, name, sections, resolved, manifest):
+    '''
+    Crawls the sections of a course one at a time until one of them leads to an
+    exam page, since exam info is per course and not per section. The sections
+    are a list of (crn, href) pairs.
+    '''
+    import urlparse
+    sections = [(crn, href) for crn, href in sections if not manifest.done('section/' + crn)]
+
+    def next_section():
+        while sections and name not in resolved:
+            crn, href = sections.pop(0)
+            if crawler.add(href, None, lambda url, html, headers: on_section(crn, url, html),
+                    errback=lambda: on_section_failed(crn)):
+                return
+
+    def on_section_failed(crn):
+        manifest.mark('section/' + crn, status='failed')
+        next_section()
+
+    def on_section(crn, url, html):
+        soup = BeautifulSoup(html)
+        links = [urlparse.urljoin(url, link['href']) for link in soup.findAll(href=re.compile(EXAM_LINK_REGEX))]
+        next_exam(crn, links)
+
+    # a section whose exam links failed is marked as failed so it's tried again
+    def next_exam(crn, links, failed=False):
+        while links and name not in resolved:
+            link = links.pop(0)
+            if crawler.add(link, None, lambda url, html, headers: on_exam(crn, html, headers, links, failed),
+                    manifest.conditional_headers('exam/' + name), lambda: next_exam(crn, links, True)):
+                return
+        manifest.mark('section/' + crn, status='failed' if failed else 'done')
+        next_section()
+
+    def on_exam(crn, html, headers, links, failed):
+        path = (EXAM_DATA_PATH % semester) + name + '.html'
+        if html is None:
+            html = open(path).read() # not modified since the last download
+        if 'Exam Date' in html and 'Exam Time' in html:
+            resolved.add(name)
+            manifest.save('exam/' + name, path, html, headers)
+            manifest.mark('section/' + crn)
+            print 'saved exam time for %s' % name
+        else:
+            next_exam(crn, links, failed)
+
+    next_section()
+
+def _crawl_departments(crawler, semester, start_url, path_template, manifest, resolved=None):
+    '''
+    Adds every department page of the semester at start_url to the crawl. If
+    resolved is a set, the exam pages of the sections on each department page
+    are crawled too and the names of courses with exam pages are added to it.
+    '''
+    import urlparse
+    url, html, headers = crawler.fetch(start_url)
 
-def download_semester(semester_name):
+    # select the <option> that starts with the text in semester variable
+    values = [value for value, label in _form_options(html) if label.startswith(semester)]
+    if not values:
+        print 'error: could not find semester "%s" on page %s' % (semester, start_url)
+        import sys
+        sys.exit()
+    url, html, headers = crawler.fetch(*_form_request(html, url, values[0]))
+
+    def crawl_sections(url, html):
+        if resolved is None:
+            return
+        by_name = {}
+        names = []
+        for link in BeautifulSoup(html).findAll(href=re.compile(SCHEDULE_LINK_REGEX)):
+            title, crn, name, index = link.text.rsplit('-', 3)
+            name = name.strip()
+            if name not in by_name:
+                names.append(name)
+            by_name.setdefault(name, []).append((crn.strip(), urlparse.urljoin(url, link['href'])))
+        for name in names:
+            _crawl_exam_times(crawler, semester, name, by_name[name], resolved, manifest)
+
+    # get the list of department codes, skipping the ones already downloaded
+    department_codes = []
+    for value, label in _form_options(html):
+        department_code = str(value)
+        path = (path_template % semester) + department_code + '.html'
+        if not manifest.done(_department_key(path_template, department_code)):
+            department_codes.append(department_code)
+        elif resolved is not None:
+            crawl_sections(url, open(path).read())
+    done = [0]
+
+    def on_department(department_code, url, html, headers):
+        path = (path_template % semester) + department_code + '.html'
+        manifest.save(_department_key(path_template, department_code), path, html, headers)
+        with crawler.lock:
+            done[0] += 1
+            print 'downloaded department %s, %.2f%% done' % (department_code,
+                100.0 * done[0] / len(department_codes))
+        crawl_sections(url, html)
+
+    for department_code in department_codes:
+        action, fields = _form_request(html, url, department_code)
+        crawler.add(action, fields, lambda url, html, headers, code=department_code:
+            on_department(code, url, html, headers), errback=lambda code=department_code:
+            manifest.mark(_department_key(path_template, code), status='failed'))
+
+def _crawl_semester(semester, manifest, schedule_url=SCHEDULE_MAIN_URL, catalog_url=CATALOG_MAIN_URL, max_in_flight=8):
+    '''
+    Crawls the schedule, catalog and exam pages of the semester concurrently and
+    stores them in the same places as the mechanize downloader. Pages that
+    couldn't be fetched are marked as failed in the manifest, so resuming tries
+    them again. Returns the number of failed requests.
+    '''
+    crawler = _Crawler(max_in_flight)
+    _crawl_departments(crawler, semester, schedule_url, SCHEDULE_DATA_PATH, manifest, manifest.names('exam'))
+    _crawl_departments(crawler, semester, catalog_url, CATALOG_DATA_PATH, manifest)
+    crawler.run()
+    return len(crawler.failures)
+
+def download_semester(semester_name, workers=1, backend='mechanize', resume=False, max_age=None, incremental=False):
     '''
     Download the entire semester given by the semester name (example: "Fall 2010")
-    and store it in the local cache directory.
+    and store it in the local cache directory. Department and exam pages are
+    downloaded by the given number of workers, each with its own browser session.
+    The 'crawler' backend instead crawls everything at once with up to workers
+    requests in flight.
+
+    Every fetched page is recorded in a manifest next to the cached pages. With
+    resume=True, pages recorded by a previous (possibly interrupted) download
+    are skipped unless they are older than max_age seconds. The crawler carries
+    on past pages it couldn't fetch, marks them as failed in the manifest and
+    raises IOError with their count at the end.
+
+    With incremental=True, pages are fetched with conditional requests where
+    the server supports them and unchanged files are left alone. Returns the
+    paths of the department, catalog and exam files whose content changed.
     '''
     print 'downloading', semester_name
+    manifest = _Manifest(semester_name, resume, max_age, incremental)
 
-    print 'downloading schedule'
-    _download_semester_helper(semester_name, SCHEDULE_MAIN_URL, SCHEDULE_DATA_PATH)
+    if backend == 'crawler':
+        print 'crawling schedule, catalog and exam times'
+        failures = _crawl_semester(semester_name, manifest, max_in_flight=workers)
+        if failures:
+            raise IOError('%d requests failed, download again with resume=True to retry them' % failures)
+    else:
+        print 'downloading schedule'
+        _download_semester_helper(semester_name, SCHEDULE_MAIN_URL, SCHEDULE_DATA_PATH, manifest, workers)
 
-    print 'downloading catalog'
-    _download_semester_helper(semester_name, CATALOG_MAIN_URL, CATALOG_DATA_PATH)
+        print 'downloading catalog'
+        _download_semester_helper(semester_name, CATALOG_MAIN_URL, CATALOG_DATA_PATH, manifest, workers)
 
-    print 'downloading exam times'
-    _download_exam_times(semester_name)
+        print 'downloading exam times'
+        _download_exam_times(semester_name, manifest, workers)
+
+    changed = sorted(manifest.changed)
+    if incremental:
+        for path in changed:
+            print 'changed', path
+        print '%d files changed' % len(changed)
+    return changed
 
 ################################################################################
 # parsing
@@ -251,156 +1392,496 @@ def _to_str_br(element):
 def _fix(text):
     return re.sub(' +', ' ', text.strip())
 
-def _parse_semester_schedule(semester_name):
-    directory = SCHEDULE_DATA_PATH % semester_name
-    filenames = os.listdir(directory)
-    name_to_course = {}
+# schedule and catalog pages keep everything the parsers read in these tables
+DATA_TABLE_STRAINER = SoupStrainer('table', 'datadisplaytable')
 
-    for i, filename in enumerate(filenames):
-        if not filename.endswith('.html'):
-            continue
+# parse a page, only building the tree for the data tables if restrict is set
+def _soup(data, restrict=False):
+    return BeautifulSoup(data, parseOnlyThese=DATA_TABLE_STRAINER if restrict else None)
 
-        data = open(directory + filename).read()
-        soup = BeautifulSoup(data)
-        for link in soup.findAll(href=re.compile(SCHEDULE_LINK_REGEX)):
-            # <table>
-            #   <tr><th><a>this link</a></th></tr>
-            #   <tr><td>the goods</td></tr>
-            # </table>
-            # a -> th -> tr -> tr -> td
-            element = link.parent.parent.nextSibling.nextSibling
-
-            # extract section information from the link
-            section = Section()
-            title, crn, name, index = link.text.rsplit('-', 3)
-            section.crn = int(_fix(crn))
-
-            # extract section information from the details
-            lines = _to_str(element).split('\n')
-            items = {}
-            for line in lines:
-                if ':' in line:
-                    key, value = line.split(':', 1)
-                    items[key] = value.strip()
-            section.levels = _fix(items.get('Levels', ''))
-            section.registration_dates = _fix(items.get('Registration Dates', ''))
-
-            # special-case crosslist data
-            xlist_data = _to_str_br(element)
-            if 'XLIST' in name and 'Associated Term:' in xlist_data:
-                section.xlist_data = xlist_data[:xlist_data.find('Associated Term:')].replace('&nbsp;', ' ').strip()
-
-            # extract meetings (xlists don't have tables)
-            table = element.find('table')
-            section.meetings = []
-            if table:
-                rows = table.findAll('tr')
-                labels = [_fix(_to_str(cell).lower()).replace(' ', '_') for cell in rows[0].findAll('th')]
-                for row in rows[1:]:
-                    cells = [_fix(_to_str(cell)) for cell in row.findAll('td')]
-                    meeting_dict = dict(zip(labels, cells))
-                    meeting = Meeting()
-                    meeting.type = meeting_dict['type']
-                    meeting.days = meeting_dict['days']
-                    meeting.time = meeting_dict['time']
-                    meeting.where = meeting_dict['where']
-                    meeting.date_range = meeting_dict['date_range']
-                    meeting.instructors = meeting_dict['instructors']
-                    section.meetings.append(meeting)
+# bump this whenever a change to the parsers changes what they extract
+PARSE_CACHE_VERSION = 3
+PARSE_CACHE_PATH = CACHE_DIR + '/%s/parsed.pickle'
+
+class _ParseCache:
+    '''
+    An on-disk cache of what the parsers extracted from each file, keyed by the
+    file path and a hash of its contents. The whole cache is thrown away when
+    PARSE_CACHE_VERSION changes. Results are kept pickled so that callers get
+    fresh objects they are free to modify.
+    '''
 
+    def __init__(self, semester):
+        self.path = PARSE_CACHE_PATH % semester
+        self.entries = self.load()
+        self.updated = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        import cPickle
+        try:
+            version, entries = cPickle.loads(open(self.path, 'rb').read())
+            if version == PARSE_CACHE_VERSION:
+                return entries
+        except Exception:
+            pass # a missing or unreadable cache is just empty
+        return {}
+
+    def get(self, path, digest):
+        '''Returns a list containing the cached result for the file, or an empty list.'''
+        import cPickle
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == digest:
+            self.hits += 1
+            return [cPickle.loads(entry[1])]
+        self.misses += 1
+        return []
+
+    def put(self, path, digest, result):
+        import cPickle
+        self.entries[path] = self.updated[path] = (digest, cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL))
+
+    def save(self):
+        '''
+        Saves the new entries on top of what is on disk now, since other parses of
+        the semester may have saved in the meantime, dropping entries for files
+        that no longer exist.
+        '''
+        import cPickle
+        entries = self.load()
+        entries.update(self.updated)
+        entries = dict((path, entry) for path, entry in entries.items() if os.path.exists(path))
+        _save(self.path + '.tmp', cPickle.dumps((PARSE_CACHE_VERSION, entries), cPickle.HIGHEST_PROTOCOL))
+        os.rename(self.path + '.tmp', self.path)
+
+def _parse_files(directory, parse_file, description, pool=None, cache=None):
+    '''
+    Calls parse_file on the path of every .html file in directory, using the
+    multiprocessing pool if given, and yields (filename, result) pairs in
+    os.listdir() order while printing progress. Files whose result is in the
+    _ParseCache cache aren't parsed again.
+    '''
+    import hashlib, itertools
+    filenames = os.listdir(directory)
+    indices = [i for i, filename in enumerate(filenames) if filename.endswith('.html')]
+    paths = [directory + filenames[i] for i in indices]
+    if cache is None:
+        results = pool.imap(parse_file, paths) if pool else itertools.imap(parse_file, paths)
+    else:
+        digests = [hashlib.sha1(open(path, 'rb').read()).hexdigest() for path in paths]
+        cached = [cache.get(path, digest) for path, digest in zip(paths, digests)]
+        missing = [path for path, result in zip(paths, cached) if not result]
+        parsed = pool.imap(parse_file, missing) if pool else itertools.imap(parse_file, missing)
+
+        def merge():
+            for path, digest, result in zip(paths, digests, cached):
+                if not result:
+                    result = [parsed.next()]
+                    cache.put(path, digest, result[0])
+                yield result[0]
+        results = merge()
+    for i, result in itertools.izip(indices, results):
+        yield filenames[i], result
+        print 'parsed %s %s, %.2f%% done' % (description, filenames[i], 100.0 * (i + 1) / len(filenames))
+
+def _make_section(link_text, text, rows):
+    '''
+    Returns the (name, title, Section) tuple for a section of a schedule page
+    given the text of its link, the text of its details, and the rows of its
+    meeting table as lists of (cell tag name, cell text) pairs (or None if the
+    details have no table). The texts are the raw strings joined together.
+    '''
+    # extract section information from the link
+    section = Section()
+    title, crn, name, index = link_text.rsplit('-', 3)
+    section.crn = int(_fix(crn))
+
+    # extract section information from the details
+    lines = text.replace('&nbsp;', ' ').strip().split('\n')
+    items = {}
+    for line in lines:
+        if ':' in line:
+            key, value = line.split(':', 1)
+            items[key] = value.strip()
+    section.levels = _fix(items.get('Levels', ''))
+    section.registration_dates = _fix(items.get('Registration Dates', ''))
+
+    # extract meetings (xlists don't have tables)
+    section.meetings = []
+    if rows is not None:
+        cell_str = lambda cell: cell[1].replace('&nbsp;', ' ').strip()
+        labels = [_fix(cell_str(cell).lower()).replace(' ', '_') for cell in rows[0] if cell[0] == 'th']
+        for row in rows[1:]:
+            cells = [_fix(cell_str(cell)) for cell in row if cell[0] == 'td']
+            meeting_dict = dict(zip(labels, cells))
+            meeting = Meeting()
+            meeting.type = meeting_dict['type']
+            meeting.days = meeting_dict['days']
+            meeting.time = meeting_dict['time']
+            meeting.where = meeting_dict['where']
+            meeting.date_range = meeting_dict['date_range']
+            meeting.instructors = meeting_dict['instructors']
+            _set_meeting_times(meeting)
+            section.meetings.append(meeting)
+
+    return _fix(name), _fix(title), section
+
+# special-case crosslist data, xlist_data is the details text with <br> as '\n'
+def _set_xlist_data(section, name, xlist_data):
+    if 'XLIST' in name and 'Associated Term:' in xlist_data:
+        section.xlist_data = xlist_data[:xlist_data.find('Associated Term:')].replace('&nbsp;', ' ').strip()
+
+def _parse_schedule_file(path, restrict=False, fast=False, validate=False):
+    '''
+    Returns a (name, title, Section) tuple for every section in a schedule page.
+    With restrict=True, only the data tables of the page are parsed. With
+    fast=True, the sections are extracted by _ScheduleExtractor instead, falling
+    back to BeautifulSoup for pages it can't handle. With validate=True as well,
+    both are used and the BeautifulSoup result wins if they differ.
+    '''
+    data = open(path).read()
+    if fast:
+        try:
+            sections = _ScheduleExtractor(data).sections
+        except _FastPathError, e:
+            print 'warning(%s): falling back to BeautifulSoup (%s)' % (path, e)
+        else:
+            if not validate:
+                return sections
+            expected = _parse_schedule_file(path, restrict)
+            if _courses_to_json_helper(map(list, sections)) != _courses_to_json_helper(map(list, expected)):
+                print 'warning(%s): fast path and BeautifulSoup disagree, using BeautifulSoup' % path
+            return expected
+
+    soup = _soup(data, restrict)
+    sections = []
+    for link in soup.findAll(href=re.compile(SCHEDULE_LINK_REGEX)):
+        # <table>
+        #   <tr><th><a>this link</a></th></tr>
+        #   <tr><td>the goods</td></tr>
+        # </table>
+        # a -> th -> tr -> tr -> td
+        element = link.parent.parent.nextSibling.nextSibling
+        table = element.find('table')
+        rows = None
+        if table:
+            rows = [[(cell.name, ''.join(cell.findAll(text=True))) for cell in row.findAll(['th', 'td'])]
+                for row in table.findAll('tr')]
+        name, title, section = _make_section(link.text, ''.join(element.findAll(text=True)), rows)
+        if 'XLIST' in name:
+            _set_xlist_data(section, name, _to_str_br(element))
+        sections.append((name, title, section))
+    return sections
+
+class _FastPathError(Exception):
+    pass
+
+class _ScheduleExtractor(SGMLParser):
+    '''
+    A fast path for schedule pages that extracts the sections straight from the
+    parser's start tag, end tag and data events, without building a tree of
+    linked PageElements. It follows BeautifulSoup's rules for text nodes,
+    entities and implicitly closed tags so it finds exactly what the tree walk
+    in _parse_schedule_file() does, and raises _FastPathError for pages with a
+    structure that it doesn't handle. The result is in self.sections.
+    '''
+
+    # a <br> in the details text, which _to_str_br() turns into '\n'
+    BR = object()
+
+    def __init__(self, data):
+        SGMLParser.__init__(self)
+        markup = UnicodeDammit(data, [None, None], smartQuotesTo=BeautifulSoup.HTML_ENTITIES, isHTML=True).unicode
+        for fix, m in BeautifulSoup.MARKUP_MASSAGE:
+            markup = fix.sub(m, markup)
+        self.sections = []
+        self.stack = [['[document]', True]] # [tag name, still open]
+        self.data = []
+        self.quote_stack = []
+        self.link = None
+        self.details = None
+        self.link_regex = re.compile(SCHEDULE_LINK_REGEX)
+        if markup:
+            self.feed(markup)
+        self.end_data()
+        while len(self.stack) > 1:
+            self.pop_tag()
+
+    def end_data(self):
+        if not self.data:
+            return
+        text = u''.join(self.data)
+        self.data = []
+        if text.translate(BeautifulSoup.STRIP_ASCII_SPACES) == '':
+            text = '\n' if '\n' in text else ' '
+
+        link, details = self.link, self.details
+        if link and link['entry'][1]:
+            link['text'].append(text.strip())
+        elif link and link['count'] is not None and len(self.stack) == link['depth']:
+            link['count'] += 1
+            if link['count'] == 2:
+                raise _FastPathError('section details are text')
+        if details:
+            details['pieces'].append(text)
+            if details['cell'] and details['cell'][1]:
+                details['rows'][-1][-1][1].append(text)
+
+    def pop_tag(self):
+        entry = self.stack.pop()
+        entry[1] = False
+        link, details = self.link, self.details
+        if link:
+            if entry is link['row']:
+                link['depth'] = len(self.stack)
+                link['count'] = 0
+            elif link['count'] is not None and len(self.stack) < link['depth']:
+                raise _FastPathError('section has no details')
+        if details and entry is details['entry']:
+            pieces = details['pieces']
+            rows = [[(cell_name, u''.join(texts)) for cell_name, texts in row] for row in details['rows']]
+            name, title, section = _make_section(details['link_text'],
+                u''.join(x for x in pieces if x is not self.BR), rows if details['table'] else None)
+            if 'XLIST' in name:
+                _set_xlist_data(section, name, u''.join('\n' if x is self.BR else x for x in pieces).strip())
+            self.sections.append((name, title, section))
+            self.details = None
+
+    def pop_to_tag(self, name, inclusive=True):
+        for i in range(len(self.stack) - 1, 0, -1):
+            if self.stack[i][0] == name:
+                for j in range(len(self.stack) - i - (0 if inclusive else 1)):
+                    self.pop_tag()
+                return
+
+    # the same as BeautifulStoneSoup._smartPop()
+    def smart_pop(self, name):
+        reset_triggers = BeautifulSoup.NESTABLE_TAGS.get(name)
+        is_reset_nesting = name in BeautifulSoup.RESET_NESTING_TAGS
+        for i in range(len(self.stack) - 1, 0, -1):
+            p = self.stack[i][0]
+            if p == name and reset_triggers is None:
+                self.pop_to_tag(name)
+                return
+            if (reset_triggers is not None and p in reset_triggers) or \
+                (reset_triggers is None and is_reset_nesting and p in BeautifulSoup.RESET_NESTING_TAGS):
+                self.pop_to_tag(p, False)
+                return
+
+    def unknown_starttag(self, name, attrs, self_closing=0):
+        if self.quote_stack:
+            self.handle_data('<%s%s>' % (name, ''.join(' %s="%s"' % (x, y) for x, y in attrs)))
+            return
+        self.end_data()
+        is_self_closing = self_closing or name in BeautifulSoup.SELF_CLOSING_TAGS
+        if not is_self_closing:
+            self.smart_pop(name)
+        entry = [name, True]
+        link, details = self.link, self.details
+
+        # the details are the next sibling after the whitespace after the link's row
+        if link and link['count'] is not None and len(self.stack) == link['depth']:
+            link['count'] += 1
+            if link['count'] == 2:
+                self.link = None
+                details = self.details = { 'entry': entry, 'link_text': u''.join(link['text']),
+                    'pieces': [], 'table': None, 'rows': [], 'cell': None }
+
+        if any(key == 'href' and self.link_regex.search(value) for key, value in attrs):
+            if self.link or (details and details['entry'] is not entry):
+                raise _FastPathError('overlapping sections')
+            if len(self.stack) < 3:
+                raise _FastPathError('section link has no row')
+            self.link = { 'entry': entry, 'row': self.stack[-2], 'text': [], 'depth': None, 'count': None }
+
+        if details and details['entry'] is not entry:
+            if name == 'br':
+                details['pieces'].append(self.BR)
+            elif details['table'] is None:
+                if name == 'table':
+                    details['table'] = entry
+            elif details['table'][1]:
+                if name == 'tr':
+                    details['rows'].append([])
+                elif name in ('th', 'td') and details['rows']:
+                    details['rows'][-1].append((name, []))
+                    details['cell'] = entry
+
+        self.stack.append(entry)
+        if is_self_closing:
+            self.pop_tag()
+        if name in BeautifulSoup.QUOTE_TAGS:
+            self.quote_stack.append(name)
+            self.literal = 1
+
+    def unknown_endtag(self, name):
+        if self.quote_stack and self.quote_stack[-1] != name:
+            self.handle_data('</%s>' % name)
+            return
+        self.end_data()
+        self.pop_to_tag(name)
+        if self.quote_stack and self.quote_stack[-1] == name:
+            self.quote_stack.pop()
+            self.literal = len(self.quote_stack) > 0
+
+    def handle_data(self, data):
+        self.data.append(data)
+
+    def handle_special(self, text):
+        self.end_data()
+        self.handle_data(text)
+        self.end_data()
+
+    def handle_pi(self, text):
+        if text[:3] == 'xml':
+            text = u"xml version='1.0' encoding='%SOUP-ENCODING%'"
+        self.handle_special(text)
+
+    def handle_comment(self, text):
+        self.handle_special(text)
+
+    def handle_decl(self, text):
+        self.handle_special(text)
+
+    def handle_charref(self, ref):
+        self.handle_data('&#%s;' % ref)
+
+    def handle_entityref(self, ref):
+        self.handle_data('&%s;' % ref)
+
+    # the same as BeautifulStoneSoup.parse_declaration()
+    def parse_declaration(self, i):
+        if self.rawdata[i:i+9] == '<![CDATA[':
+            k = self.rawdata.find(']]>', i)
+            if k == -1:
+                k = len(self.rawdata)
+            self.handle_special(self.rawdata[i+9:k])
+            return k + 3
+        try:
+            return SGMLParser.parse_declaration(self, i)
+        except SGMLParseError:
+            self.handle_data(self.rawdata[i:])
+            return len(self.rawdata)
+
+def _parse_semester_schedule(semester_name, pool=None, cache=None, restrict=False, fast=False, validate=False):
+    import functools
+    parse_file = functools.partial(_parse_schedule_file, restrict=restrict, fast=fast, validate=validate)
+    name_to_course = {}
+    for filename, sections in _parse_files(SCHEDULE_DATA_PATH % semester_name, parse_file, 'schedule', pool, cache):
+        for name, title, section in sections:
             # add section to courses, creating a course if necessary
-            name = _fix(name)
-            title = _fix(title)
             course = name_to_course.setdefault(name, Course())
             if course.title and course.title != title:
                 print 'warning(%s): title "%s" and "%s" differ' % (name, course.title, title)
             course.name = name
             course.title = title
             course.get_semester(semester_name).sections.append(section)
-        print 'parsed schedule %s, %.2f%% done' % (filename, 100.0 * (i + 1) / len(filenames))
     return name_to_course.values()
 
-def _parse_semester_catalog(semester_name):
-    directory = CATALOG_DATA_PATH % semester_name
-    filenames = os.listdir(directory)
+def _parse_catalog_file(path, restrict=False):
+    '''
+    Returns a Course for every course in a catalog page. With restrict=True,
+    only the data tables of the page are parsed.
+    '''
+    data = open(path).read()
+    soup = _soup(data, restrict)
     courses = []
+    for link in soup.findAll(href=re.compile(CATALOG_LINK_REGEX)):
+        # <table>
+        #   <tr><td><a>this link</a></td></tr>
+        #   <tr><td>the goods</td></tr>
+        # </table>
+        # a -> td -> tr -> tr -> td
+        element = link.parent.parent.nextSibling.nextSibling
+
+        # extract course information from the link
+        course = Course()
+        name, title = link.text.split('-', 1)
+        course.name = _fix(name)
+        course.title = _fix(title)
+
+        # extract course information from the details
+        lines = _to_str(element).split('\n')
+        description = ''
+        reading_description = True
+        for line in lines:
+            line = _fix(line)
+            if line.endswith('Credit hours') or line.endswith('Lecture hours'):
+                reading_description = False
+            elif line.startswith('Course Attributes:'):
+                course.attributes = _fix(line[line.find(':')+1:])
+            elif reading_description:
+                description += line + '\n'
+        course.description = _fix(description)
 
-    for i, filename in enumerate(filenames):
-        if not filename.endswith('.html'):
-            continue
-
-        data = open(directory + filename).read()
-        soup = BeautifulSoup(data)
-        for link in soup.findAll(href=re.compile(CATALOG_LINK_REGEX)):
-            # <table>
-            #   <tr><td><a>this link</a></td></tr>
-            #   <tr><td>the goods</td></tr>
-            # </table>
-            # a -> td -> tr -> tr -> td
-            element = link.parent.parent.nextSibling.nextSibling
-
-            # extract course information from the link
-            course = Course()
-            name, title = link.text.split('-', 1)
-            course.name = _fix(name)
-            course.title = _fix(title)
-
-            # extract course information from the details
-            lines = _to_str(element).split('\n')
-            description = ''
-            reading_description = True
-            for line in lines:
-                line = _fix(line)
-                if line.endswith('Credit hours') or line.endswith('Lecture hours'):
-                    reading_description = False
-                elif line.startswith('Course Attributes:'):
-                    course.attributes = _fix(line[line.find(':')+1:])
-                elif reading_description:
-                    description += line + '\n'
-            course.description = _fix(description)
-
-            courses.append(course)
-        print 'parsed catalog %s, %.2f%% done' % (filename, 100.0 * (i + 1) / len(filenames))
+        courses.append(course)
     return courses
 
-def _parse_exam_times(semester_name):
-    directory = EXAM_DATA_PATH % semester_name
-    filenames = os.listdir(directory)
+def _parse_semester_catalog(semester_name, pool=None, cache=None, restrict=False):
+    import functools
+    parse_file = functools.partial(_parse_catalog_file, restrict=restrict)
     courses = []
+    for filename, file_courses in _parse_files(CATALOG_DATA_PATH % semester_name, parse_file, 'catalog', pool, cache):
+        courses.extend(file_courses)
+    return courses
 
-    for i, filename in enumerate(filenames):
-        if not filename.endswith('.html'):
-            continue
-
-        data = open(directory + filename).read()
-        exam_time = None
-        exam_date = None
-        soup = BeautifulSoup(data)
-        for element in soup.findAll(text='Exam Date'):
-            exam_date = element.parent.nextSibling.nextSibling.text
-        for element in soup.findAll(text='Exam Time'):
-            exam_time = element.parent.nextSibling.nextSibling.text
-        if exam_date and exam_time:
+def _parse_exam_file(path):
+    '''Returns the (exam date, exam time) pair in an exam page, or None.'''
+    data = open(path).read()
+    exam_time = None
+    exam_date = None
+    soup = BeautifulSoup(data)
+    for element in soup.findAll(text='Exam Date'):
+        exam_date = element.parent.nextSibling.nextSibling.text
+    for element in soup.findAll(text='Exam Time'):
+        exam_time = element.parent.nextSibling.nextSibling.text
+    if exam_date and exam_time:
+        return exam_date, exam_time
+    return None
+
+def _parse_exam_times(semester_name, pool=None, cache=None):
+    courses = []
+    for filename, exam in _parse_files(EXAM_DATA_PATH % semester_name, _parse_exam_file, 'exam time', pool, cache):
+        if exam:
             course = Course()
             course.name = filename.replace('.html', '')
             courses.append(course)
             semester = course.get_semester(semester_name)
-            semester.exam_date = exam_date
-            semester.exam_time = exam_time
-
-        print 'parsed exam time %s, %.2f%% done' % (filename, 100.0 * (i + 1) / len(filenames))
+            semester.exam_date, semester.exam_time = exam
     return courses
 
-def parse_semester(semester_name):
+def parse_semester(semester_name, jobs=1, cache=True, restrict=False, fast=False, validate=False, compact=False):
     '''
     Parse the entire semester given by the semester name (example: "Fall 2010")
     and return a list of Course objects for that semester. Must download the
-    semester with download_semester() before parsing.
+    semester with download_semester() before parsing. With jobs > 1, the pages
+    are parsed by that many processes and the result is the same as parsing
+    them serially. With cache=True, what was extracted from each page is kept
+    in the local cache directory and only new or modified pages are parsed.
+    With restrict=True, only the data tables of the schedule and catalog pages
+    are parsed, which is faster and uses less memory for the same result.
+    With fast=True, sections are extracted from the schedule pages without
+    building a tree at all, and validate=True checks that against BeautifulSoup.
+    With compact=True, the result is made of CompactCourse objects.
     '''
     print 'parsing semester', semester_name
-    schedule_courses = _parse_semester_schedule(semester_name)
-    catalog_courses = _parse_semester_catalog(semester_name)
-    exam_time_courses = _parse_exam_times(semester_name)
+    pool = None
+    if jobs > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs)
+    parse_cache = _ParseCache(semester_name) if cache else None
+    try:
+        schedule_courses = _parse_semester_schedule(semester_name, pool, parse_cache, restrict, fast, validate)
+        catalog_courses = _parse_semester_catalog(semester_name, pool, parse_cache, restrict)
+        exam_time_courses = _parse_exam_times(semester_name, pool, parse_cache)
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+
+    if parse_cache:
+        parse_cache.save()
 
     # make indices for quick access
     schedule_index = dict((course.name, course) for course in schedule_courses)
@@ -437,8 +1918,653 @@ def parse_semester(semester_name):
             semester.exam_time = exam_time_semester.exam_time
             semester.exam_date = exam_time_semester.exam_date
 
+    intern_courses(courses)
+    if compact:
+        return compact_courses(courses)
     return courses
 
+def _iter_semester_files(semester_name, path_template, parse_file, description, jobs, cache):
+    '''Yields the result of parse_file for each page in the semester directory as it is parsed.'''
+    pool = None
+    if jobs > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs)
+    parse_cache = _ParseCache(semester_name) if cache else None
+    try:
+        for filename, result in _parse_files(path_template % semester_name, parse_file, description, pool, parse_cache):
+            yield result
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+    if parse_cache:
+        parse_cache.save()
+
+def iter_semester_sections(semester_name, jobs=1, cache=True, restrict=False, fast=False, validate=False):
+    '''
+    Yields a (course name, course title, Section) tuple for every section in the
+    schedule of the semester given by the semester name (example: "Fall 2010"),
+    one department page at a time, so that only one page of sections needs to
+    be in memory. The options are the same as for parse_semester().
+    '''
+    import functools
+    parse_file = functools.partial(_parse_schedule_file, restrict=restrict, fast=fast, validate=validate)
+    for sections in _iter_semester_files(semester_name, SCHEDULE_DATA_PATH, parse_file, 'schedule', jobs, cache):
+        for name, title, section in sections:
+            _intern_section(section, intern_table)
+            yield name, title, section
+
+def iter_semester_courses(semester_name, jobs=1, cache=True, restrict=False):
+    '''
+    Yields a Course object for every course in the catalog of the semester given
+    by the semester name (example: "Fall 2010"), one department page at a time.
+    These only have catalog information (no semesters). The options are the
+    same as for parse_semester().
+    '''
+    import functools
+    parse_file = functools.partial(_parse_catalog_file, restrict=restrict)
+    for courses in _iter_semester_files(semester_name, CATALOG_DATA_PATH, parse_file, 'catalog', jobs, cache):
+        for course in courses:
+            yield course
+
+################################################################################
+# columnar meeting table
+################################################################################
+
+class MeetingTable:
+    '''
+    A column-oriented view of every meeting in a list of courses, where the ith
+    meeting is described by the ith entry of each column:
+
+      crn          the CRN of the meeting's section
+      course       the index of the course in self.courses
+      semester     the index of the semester name in self.semester_names
+      type         the index of Meeting.type in self.types
+      days         the day bitmask (see DAY_BITS)
+      start, end   the minutes since midnight, -1 if the time is TBA
+      room         the index of Meeting.where in self.rooms
+      instructor   the index of Meeting.instructors in self.instructors
+
+    The columns are arrays from the array module, or NumPy arrays if use_numpy
+    is True (or None, the default, and NumPy is installed).
+    '''
+
+    COLUMNS = [('crn', 'i'), ('course', 'i'), ('semester', 'i'), ('type', 'i'), ('days', 'B'),
+        ('start', 'h'), ('end', 'h'), ('room', 'i'), ('instructor', 'i')]
+
+    def __init__(self, courses, use_numpy=None):
+        import array
+        self.courses = list(courses)
+        self.semester_names = []
+        self.types = []
+        self.rooms = []
+        self.instructors = []
+        ids = {}
+        columns = dict((name, array.array(typecode)) for name, typecode in self.COLUMNS)
+
+        # looks up the index of a value in one of the lists above, adding it if needed
+        def id_of(values, value):
+            key = (id(values), value)
+            if key not in ids:
+                ids[key] = len(values)
+                values.append(value)
+            return ids[key]
+
+        for course_index, course in enumerate(self.courses):
+            for semester in course.semesters:
+                semester_index = id_of(self.semester_names, semester.name)
+                for section in semester.sections:
+                    for meeting in section.meetings:
+                        columns['crn'].append(section.crn)
+                        columns['course'].append(course_index)
+                        columns['semester'].append(semester_index)
+                        columns['type'].append(id_of(self.types, meeting.type))
+                        columns['days'].append(meeting.day_mask)
+                        columns['start'].append(meeting.start_time)
+                        columns['end'].append(meeting.end_time)
+                        columns['room'].append(id_of(self.rooms, meeting.where))
+                        columns['instructor'].append(id_of(self.instructors, meeting.instructors))
+
+        if use_numpy is not False:
+            try:
+                import numpy
+                dtypes = { 'i': numpy.int32, 'B': numpy.uint8, 'h': numpy.int16 }
+                for name, typecode in self.COLUMNS:
+                    columns[name] = numpy.frombuffer(columns[name], dtypes[typecode])
+            except ImportError:
+                if use_numpy:
+                    raise
+        for name in columns:
+            setattr(self, name, columns[name])
+
+    def __len__(self):
+        return len(self.crn)
+
+################################################################################
+# conflict detection
+################################################################################
+
+def _dates_overlap(a, b):
+    if a.start_date < 0 or b.start_date < 0:
+        return True
+    return a.start_date <= b.end_date and b.start_date <= a.end_date
+
+def _meetings_overlap(a, b):
+    '''Returns True if two meetings conflict by the same rule as find_conflicts().'''
+    return bool(a.day_mask & b.day_mask) and 0 <= a.start_time < b.end_time and \
+        0 <= b.start_time < a.end_time and _dates_overlap(a, b)
+
+def _overlapping_meetings(items):
+    '''
+    Takes a list of (meeting, key) pairs and returns the set of (i, j) index
+    pairs with i < j whose meetings overlap and whose keys differ. Each weekday
+    is swept in order of start time while a heap holds the meetings that haven't
+    ended yet, so only overlapping meetings are ever compared.
+    '''
+    import heapq
+    pairs = set()
+    for bit in sorted(DAY_BITS.values()):
+        intervals = sorted((meeting.start_time, meeting.end_time, i) for i, (meeting, key) in enumerate(items)
+            if meeting.day_mask & bit and 0 <= meeting.start_time < meeting.end_time)
+        active = []
+        for start, end, i in intervals:
+            while active and active[0][0] <= start:
+                heapq.heappop(active)
+            for other_end, j in active:
+                if items[i][1] != items[j][1] and _dates_overlap(items[i][0], items[j][0]):
+                    pairs.add((min(i, j), max(i, j)))
+            heapq.heappush(active, (end, i))
+    return pairs
+
+def _semester_meetings(courses, semester_name, crns=None):
+    items = []
+    for course in courses:
+        semester = _find_semester(course, semester_name)
+        if semester is None:
+            continue
+        for section in semester.sections:
+            if crns is None or section.crn in crns:
+                items += [(meeting, section.crn) for meeting in section.meetings]
+    return items
+
+def find_conflicts(courses, semester_name, crns=None):
+    '''
+    Returns the pairs of meetings in the named semester of a list of Course
+    objects that are on the same weekday at overlapping times (and in
+    overlapping date ranges when both are known), as a list of
+    ((crn, meeting), (other_crn, other_meeting)) tuples. Only the sections in
+    crns are checked if it's given, and meetings of the same section never
+    conflict with each other.
+    '''
+    items = _semester_meetings(courses, semester_name, crns and set(crns))
+    return [((items[i][1], items[i][0]), (items[j][1], items[j][0])) for i, j in sorted(_overlapping_meetings(items))]
+
+def conflict_graph(courses, semester_name):
+    '''
+    Returns a dict from the CRN of every section in the named semester of a list
+    of Course objects to the set of CRNs of the sections it conflicts with (see
+    find_conflicts()), so checking a set of sections only takes set lookups.
+    '''
+    items = _semester_meetings(courses, semester_name)
+    graph = dict((crn, set()) for meeting, crn in items)
+    for i, j in _overlapping_meetings(items):
+        graph[items[i][1]].add(items[j][1])
+        graph[items[j][1]].add(items[i][1])
+    return graph
+
+################################################################################
+# timetables
+################################################################################
+
+MINUTES_PER_DAY = 24 * 60
+
+def _week_mask(section):
+    '''Returns an int with a bit for every minute of the week that a section meets.'''
+    mask = 0
+    for meeting in section.meetings:
+        if 0 <= meeting.start_time < meeting.end_time:
+            minutes = ((1 << (meeting.end_time - meeting.start_time)) - 1) << meeting.start_time
+            for day in range(7):
+                if meeting.day_mask & (1 << day):
+                    mask |= minutes << (day * MINUTES_PER_DAY)
+    return mask
+
+def _meeting_types(section):
+    return tuple(sorted(set(meeting.type for meeting in section.meetings)))
+
+def iter_timetables(courses, semester_name, course_names, component=_meeting_types):
+    '''
+    Generates every way to pick sections of the named courses in a semester
+    without time conflicts, using the same rule as find_conflicts(). The
+    sections of each course are grouped by component(section) and each
+    timetable is a list with one section from every group. Nothing is generated
+    if one of the courses isn't offered that semester.
+
+    The default component is the tuple of the section's Meeting.type values,
+    but Banner lists almost every meeting as "Class", so by default a course
+    usually needs just one section. To require one lecture, one conference and
+    one lab section, pass a component function that tells them apart.
+
+    The search always branches on the group with the fewest sections that fit
+    into the timetable so far, and backs up as soon as some group has none, so
+    most of the combinations are never looked at. A fit is checked with the
+    weekly bitmasks, and only when those collide are the meetings compared,
+    since meetings in the same weekly slot don't conflict if their date ranges
+    don't overlap.
+    '''
+    by_name = dict((course.name, course) for course in courses)
+    groups = []
+    for name in course_names:
+        semester = name in by_name and _find_semester(by_name[name], semester_name)
+        if not semester or not semester.sections:
+            return
+        by_component = {}
+        for section in semester.sections:
+            by_component.setdefault(component(section), []).append((section, _week_mask(section)))
+        groups += [by_component[x] for x in sorted(by_component)]
+    chosen = [None] * len(groups)
+
+    def fits(section, mask, used, picked):
+        if not mask & used:
+            return True
+        return not any(_meetings_overlap(a, b) for other in picked
+            for a in section.meetings for b in other.meetings)
+
+    def search(used, remaining):
+        if not remaining:
+            yield list(chosen)
+            return
+        picked = [chosen[i] for i in range(len(groups)) if i not in remaining]
+        best = None
+        for index in remaining:
+            options = [x for x in groups[index] if fits(x[0], x[1], used, picked)]
+            if not options:
+                return
+            if best is None or len(options) < len(best[1]):
+                best = (index, options)
+        index, options = best
+        remaining = [x for x in remaining if x != index]
+        for section, mask in options:
+            chosen[index] = section
+            for timetable in search(used | mask, remaining):
+                yield timetable
+
+    for timetable in search(0, range(len(groups))):
+        yield timetable
+
+def find_timetables(courses, semester_name, course_names, limit=None, component=_meeting_types):
+    '''Returns a list of at most limit (or all) of the timetables from iter_timetables().'''
+    import itertools
+    return list(itertools.islice(iter_timetables(courses, semester_name, course_names, component), limit))
+
+################################################################################
+# room occupancy
+################################################################################
+
+class RoomIndex:
+    '''
+    The times that each room (Meeting.where) is used during a semester, built in
+    one pass over a list of Course objects. Meetings without a known time or
+    room are left out, and date ranges are ignored. Times are minutes since
+    midnight and days are Meeting.days strings like "TR".
+    '''
+
+    def __init__(self, courses, semester_name):
+        self.intervals = {}
+        for meeting, crn in _semester_meetings(courses, semester_name):
+            if 0 <= meeting.start_time < meeting.end_time and meeting.where not in ('', 'TBA'):
+                days = self.intervals.setdefault(meeting.where, [[] for day in range(7)])
+                for day in range(7):
+                    if meeting.day_mask & (1 << day):
+                        days[day].append((meeting.start_time, meeting.end_time))
+
+        # for each room and day, the sorted start times and the latest end time
+        # of the intervals up to each one, so an overlap test is one bisection
+        self._starts = {}
+        self._latest_ends = {}
+        for room, days in self.intervals.items():
+            self._starts[room] = []
+            self._latest_ends[room] = []
+            for intervals in days:
+                intervals.sort()
+                latest_ends = []
+                for start, end in intervals:
+                    latest_ends.append(max(end, latest_ends and latest_ends[-1] or 0))
+                self._starts[room].append([start for start, end in intervals])
+                self._latest_ends[room].append(latest_ends)
+
+    def rooms(self):
+        '''Returns the sorted list of rooms used during the semester.'''
+        return sorted(self.intervals)
+
+    def is_free(self, room, days, start_time, end_time):
+        '''Returns True if nothing meets in room between the times on any of the days.'''
+        import bisect
+        if room not in self._starts:
+            return True # nothing meets there all semester
+        mask = _parse_days(days)
+        for day in range(7):
+            if mask & (1 << day):
+                count = bisect.bisect_left(self._starts[room][day], end_time)
+                if count and self._latest_ends[room][day][count - 1] > start_time:
+                    return False
+        return True
+
+    def free_rooms(self, days, start_time, end_time):
+        '''Returns the sorted list of rooms where nothing meets between the times on any of the days.'''
+        return [room for room in self.rooms() if self.is_free(room, days, start_time, end_time)]
+
+    def utilisation(self, days='MTWRF', start_time=8 * 60, end_time=22 * 60):
+        '''
+        Returns a dict from room to the percentage of the time between start_time
+        and end_time on the days that something meets there.
+        '''
+        mask = _parse_days(days)
+        day_count = len([day for day in range(7) if mask & (1 << day)])
+        total = day_count * (end_time - start_time)
+        result = {}
+        for room, days in self.intervals.items():
+            used = 0
+            for day in range(7):
+                if mask & (1 << day):
+                    # add up the union of the intervals, clipped to the window
+                    covered = start_time
+                    for start, end in days[day]:
+                        start, end = max(start, covered), min(end, end_time)
+                        if end > start:
+                            used += end - start
+                            covered = end
+            result[room] = 100.0 * used / total if total > 0 else 0.0
+        return result
+
+################################################################################
+# course index
+################################################################################
+
+def _split_instructors(instructors):
+    '''Returns the names in a Meeting.instructors string like "Ann Smith (P), Bob Jones".'''
+    names = [re.sub(r'\s*\(P\)$', '', x).strip() for x in instructors.split(',')]
+    return [x for x in names if x and x != 'TBA']
+
+class CourseIndex:
+    '''
+    Lookup tables for a list of Course objects, which can be updated with add()
+    after more semesters are merged in:
+
+      index.course('CSCI 0150')
+      index.sections(12345)          -> [(course, semester, section), ...]
+      index.by_instructor('Ann Smith')
+      index.by_attribute('LILE')
+      index.by_department('CSCI')
+      index.by_semester('Fall 2011')
+
+    The by_ methods return lists of courses sorted by name.
+    '''
+
+    def __init__(self, courses=()):
+        self.courses = {}
+        self.crns = {}
+        self.instructors = {}
+        self.attributes = {}
+        self.departments = {}
+        self.semesters = {}
+        self._tokens = {}
+        self._indexed = set()
+        self.add(courses)
+
+    def add(self, courses):
+        '''
+        Indexes courses and the semesters of courses that aren't indexed yet. A
+        course with the name of one that is already indexed (like the new courses
+        passed to merge_courses()) is indexed as that course, using its new
+        attributes.
+        '''
+        for course in courses:
+            indexed = self.courses.setdefault(course.name, course)
+            for token in self._tokens.get(course.name, ()):
+                self.attributes[token].discard(course.name)
+            self._tokens[course.name] = [x for x in re.split(r'[\s,]+', course.attributes) if x]
+            for token in self._tokens[course.name]:
+                self.attributes.setdefault(token, set()).add(course.name)
+            self.departments.setdefault(course.name.split(' ')[0], set()).add(course.name)
+            for semester in course.semesters:
+                if (course.name, semester.name) in self._indexed:
+                    continue
+                self._indexed.add((course.name, semester.name))
+                self.semesters.setdefault(semester.name, set()).add(course.name)
+                for section in semester.sections:
+                    self.crns.setdefault(section.crn, []).append((indexed, semester, section))
+                    for meeting in section.meetings:
+                        for name in _split_instructors(meeting.instructors):
+                            self.instructors.setdefault(name, set()).add(course.name)
+
+    def _lookup(self, table, key):
+        return [self.courses[x] for x in sorted(table.get(key, ()))]
+
+    def course(self, name):
+        '''Returns the course with the given name, or None if there isn't one.'''
+        return self.courses.get(name)
+
+    def sections(self, crn):
+        '''Returns a (course, semester, section) tuple for each semester with a section with the given CRN.'''
+        return list(self.crns.get(crn, ()))
+
+    def by_instructor(self, name):
+        return self._lookup(self.instructors, name)
+
+    def by_attribute(self, token):
+        return self._lookup(self.attributes, token)
+
+    def by_department(self, department):
+        return self._lookup(self.departments, department)
+
+    def by_semester(self, semester_name):
+        return self._lookup(self.semesters, semester_name)
+
+################################################################################
+# full-text search
+################################################################################
+
+SEARCH_INDEX_VERSION = 1
+
+def _search_tokens(text):
+    return re.findall(r'[a-z0-9]+', text.lower())
+
+class SearchIndex:
+    '''
+    An inverted index over the title, description and attributes of a list of
+    Course objects that ranks courses with BM25. A query matches the courses
+    that contain all of its parts, where a part is a word, a word ending in *
+    for any word starting with it, or a "quoted phrase". The index only keeps
+    course names, so it can be saved to disk and loaded without the courses.
+    '''
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, courses=()):
+        self.names = []
+        self.ids = {}
+        self.lengths = []
+        self.total_length = 0
+        self.digests = []
+        self.doc_terms = []
+        self.postings = {}
+        self._terms = None
+        self._norms_cache = None
+        self.add(courses)
+
+    def add(self, courses):
+        '''
+        Indexes new courses and indexes again courses whose text changed, like
+        the ones that merge_courses() updated. Unchanged courses are skipped.
+        '''
+        import hashlib
+        for course in courses:
+            fields = (course.title, course.description, course.attributes)
+            digest = hashlib.sha1(repr(fields)).digest()
+            doc = self.ids.get(course.name)
+            if doc is None:
+                doc = self.ids[course.name] = len(self.names)
+                self.names.append(course.name)
+                self.lengths.append(0)
+                self.digests.append(None)
+                self.doc_terms.append(())
+            elif self.digests[doc] == digest:
+                continue
+            else:
+                for term in self.doc_terms[doc]:
+                    del self.postings[term][doc]
+                    if not self.postings[term]:
+                        del self.postings[term]
+            self.digests[doc] = digest
+
+            # leave a gap between fields so phrases don't span two of them
+            position = 0
+            terms = set()
+            for field in fields:
+                for token in _search_tokens(field):
+                    terms.add(token)
+                    self.postings.setdefault(token, {}).setdefault(doc, []).append(position)
+                    position += 1
+                position += 1
+            self.total_length += position - len(fields) - self.lengths[doc]
+            self.lengths[doc] = position - len(fields)
+            self.doc_terms[doc] = tuple(terms)
+            self._terms = None
+            self._norms_cache = None
+
+    # each part of a query is a dict from matching document to term (or phrase) frequency
+
+    def _norms(self):
+        '''Returns the length normalization of every document, computed once after each add().'''
+        if self._norms_cache is None:
+            average = float(self.total_length) / len(self.names) or 1 # every course could have empty text
+            self._norms_cache = [self.K1 * (1 - self.B + self.B * length / average) for length in self.lengths]
+        return self._norms_cache
+
+    def _term_frequencies(self, term):
+        return dict((doc, len(positions)) for doc, positions in self.postings.get(term, {}).iteritems())
+
+    def _prefix_frequencies(self, prefix):
+        import bisect
+        if self._terms is None:
+            self._terms = sorted(self.postings)
+        frequencies = {}
+        for term in self._terms[bisect.bisect_left(self._terms, prefix):]:
+            if not term.startswith(prefix):
+                break
+            for doc, positions in self.postings[term].iteritems():
+                frequencies[doc] = frequencies.get(doc, 0) + len(positions)
+        return frequencies
+
+    def _phrase_frequencies(self, tokens):
+        postings = [self.postings.get(token, {}) for token in tokens]
+        frequencies = {}
+        for doc in set(postings[0]).intersection(*postings[1:]):
+            later = [set(positions[doc]) for positions in postings[1:]]
+            count = len([p for p in postings[0][doc] if all(p + i + 1 in x for i, x in enumerate(later))])
+            if count:
+                frequencies[doc] = count
+        return frequencies
+
+    def search(self, query, limit=10):
+        '''Returns up to limit (name, score) pairs for the courses matching query, best first.'''
+        import heapq, math
+        if not self.names:
+            return []
+        parts = []
+        for phrase, word in re.findall(r'"([^"]*)"|(\S+)', query):
+            tokens = _search_tokens(phrase or word)
+            if phrase and len(tokens) > 1:
+                parts.append(self._phrase_frequencies(tokens))
+                continue
+            if word.endswith('*') and tokens:
+                parts.append(self._prefix_frequencies(tokens.pop()))
+            parts += [self._term_frequencies(token) for token in tokens]
+        if not parts:
+            return []
+
+        # only score the documents that match every part, with BM25
+        parts.sort(key=len)
+        docs = list(parts[0]) if len(parts) == 1 else [doc for doc in parts[0] if all(doc in part for part in parts[1:])]
+        norms = self._norms()
+        scores = dict.fromkeys(docs, 0.0)
+        for part in parts:
+            idf = math.log(1 + (len(self.names) - len(part) + 0.5) / (len(part) + 0.5))
+            for doc in docs:
+                tf = part[doc]
+                scores[doc] += idf * tf * (self.K1 + 1) / (tf + norms[doc])
+        results = heapq.nsmallest(limit, ((-score, self.names[doc]) for doc, score in scores.iteritems()))
+        return [(name, -score) for score, name in results]
+
+    def save(self, path):
+        import cPickle
+        state = (self.names, self.lengths, self.digests, self.doc_terms, self.postings)
+        _save(path + '.tmp', cPickle.dumps((SEARCH_INDEX_VERSION, state), cPickle.HIGHEST_PROTOCOL))
+        os.rename(path + '.tmp', path)
+
+    @staticmethod
+    def load(path):
+        '''Returns the SearchIndex saved in path, or an empty one if it was saved by another version.'''
+        import cPickle
+        version, state = cPickle.loads(open(path, 'rb').read())
+        index = SearchIndex()
+        if version == SEARCH_INDEX_VERSION:
+            index.names, index.lengths, index.digests, index.doc_terms, index.postings = state
+            index.ids = dict((name, doc) for doc, name in enumerate(index.names))
+            index.total_length = sum(index.lengths)
+        return index
+
+################################################################################
+# autocomplete
+################################################################################
+
+class Autocomplete:
+    '''
+    Completes what's been typed into a search box to course names and titles.
+    Course names ("CSCI 0150") are matched ignoring case and spaces, and titles
+    are matched from the start of any word, so "comp sci" doesn't match but
+    "computer sci" and "science" both match "Intro to Computer Science". The
+    keys are kept in sorted lists so a completion is a bisection and a short
+    scan no matter how many courses there are.
+    '''
+
+    def __init__(self, courses):
+        self.titles = {}
+        names = []
+        titles = []
+        for course in courses:
+            self.titles[course.name] = course.title
+            names.append((course.name.lower().replace(' ', ''), course.name))
+            words = _search_tokens(course.title)
+            titles += [(' '.join(words[i:]), course.name) for i in range(len(words))]
+        names.sort()
+        titles.sort()
+        self._name_keys = [key for key, name in names]
+        self._name_values = [name for key, name in names]
+        self._title_keys = [key for key, name in titles]
+        self._title_values = [name for key, name in titles]
+
+    def complete(self, text, limit=10):
+        '''
+        Returns up to limit (name, title) pairs for the courses matching text, first
+        the ones whose name matches in order of name, then the ones whose title
+        matches in order of the matching part of the title.
+        '''
+        import bisect
+        names = []
+        for keys, values, prefix in [(self._name_keys, self._name_values, text.lower().replace(' ', '')),
+                (self._title_keys, self._title_values, ' '.join(_search_tokens(text)))]:
+            if not prefix:
+                continue
+            i = bisect.bisect_left(keys, prefix)
+            while i < len(keys) and len(names) < limit and keys[i].startswith(prefix):
+                if values[i] not in names:
+                    names.append(values[i])
+                i += 1
+        return [(name, self.titles[name]) for name in names]
+
 ################################################################################
 # merging
 ################################################################################
@@ -480,13 +2606,204 @@ def merge_courses(old_courses, new_courses):
 
     return courses_index.values()
 
+################################################################################
+# benchmarks
+################################################################################
+
+def _make_test_courses(semesters=10, courses=500, sections=3, meetings=2):
+    '''
+    Returns a made-up list of courses that each have the given number of
+    semesters, sections per semester, and meetings per section. Every string is
+    a separate object like it would be after parsing.
+    '''
+    copy = lambda text: (text + '.')[:-1]
+    result = []
+    for i in range(courses):
+        course = Course()
+        course.name = 'DEPT %04d' % i
+        course.title = 'Course Title %d' % i
+        course.attributes = copy('LILE Lecture Course')
+        course.description = 'A description of course %d. ' % i * 5
+        for j in range(semesters):
+            semester = course.get_semester(['Fall', 'Spring'][j % 2] + ' %d' % (2000 + (j + 1) / 2))
+            for k in range(sections):
+                section = Section()
+                section.crn = 10000 + (i * semesters + j) * sections + k
+                section.levels = copy('Graduate, Undergraduate')
+                section.registration_dates = copy('Apr 04, 2011 to Sep 21, 2011')
+                for l in range(meetings):
+                    meeting = Meeting()
+                    meeting.type = copy('Class')
+                    meeting.days = copy(['MWF', 'TR'][(k + l) % 2])
+                    meeting.time = copy(['10:00 am - 10:50 am', '1:00 pm - 2:20 pm'][(k + l) % 2])
+                    meeting.where = copy('Salomon Center %d' % (100 + (i + l) % 20))
+                    meeting.date_range = copy('Sep 07, 2011 - Dec 21, 2011')
+                    meeting.instructors = copy('Instructor %d (P)' % (i % 300))
+                    _set_meeting_times(meeting)
+                    section.meetings.append(meeting)
+                semester.sections.append(section)
+        result.append(course)
+    return result
+
+def _deep_size(obj):
+    '''Returns the number of bytes taken by obj and every object reachable from it.'''
+    import sys
+    seen = set()
+    pending = [obj]
+    size = 0
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, list):
+            pending.extend(obj)
+        elif isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+        elif hasattr(obj, '__dict__'):
+            pending.append(obj.__dict__)
+        elif isinstance(obj, _Compact):
+            pending.extend(getattr(obj, x) for x in obj.fields if hasattr(obj, x))
+    return size
+
+def benchmark_memory(semesters=10, courses=500, sections=3, meetings=2):
+    '''
+    Prints how much memory the regular and the compact classes take for a
+    made-up multi-semester list of courses.
+    '''
+    regular = _make_test_courses(semesters, courses, sections, meetings)
+    compact = compact_courses(regular)
+    count = semesters * courses * sections * meetings
+    regular_size = _deep_size(regular)
+    compact_size = _deep_size(compact)
+    print '%d courses, %d semesters, %d meetings' % (courses, semesters, count)
+    print 'regular classes: %.1f MB (%d bytes per meeting)' % (regular_size / 1e6, regular_size / count)
+    print 'compact classes: %.1f MB (%d bytes per meeting)' % (compact_size / 1e6, compact_size / count)
+    print 'compact classes save %.1f%%' % (100.0 * (regular_size - compact_size) / regular_size)
+
 ################################################################################
 # unit tests
 ################################################################################
 
 import unittest
 
-class _Tester(unittest.TestCase):
+_TEST_SCHEDULE_SECTION = '''<tr>
+<th CLASS="ddtitle" scope="colgroup" ><a href="/ss/bwckschd.p_disp_detail_sched?term_in=201110&amp;crn_in=%(crn)s">%(title)s - %(crn)s - %(name)s - %(index)s</a></th>
+</tr>
+<tr>
+<td CLASS="dddefault">
+%(xlist)s<SPAN class="fieldlabeltext">Associated Term: </SPAN>Fall 2011
+<br>
+<SPAN class="fieldlabeltext">Registration Dates: </SPAN>Apr 04, 2011 to Sep 21, 2011
+<br>
+<SPAN class="fieldlabeltext">Levels: </SPAN>Graduate, Undergraduate
+<br>
+<br>
+<table CLASS="datadisplaytable" SUMMARY="This table lists the scheduled meeting times and assigned instructors for this class..">
+<caption class="captiontext">Scheduled Meeting Times</caption>
+<tr>
+<th CLASS="ddheader" scope="col" >Type</th>
+<th CLASS="ddheader" scope="col" >Time</th>
+<th CLASS="ddheader" scope="col" >Days</th>
+<th CLASS="ddheader" scope="col" >Where</th>
+<th CLASS="ddheader" scope="col" >Date Range</th>
+<th CLASS="ddheader" scope="col" >Schedule Type</th>
+<th CLASS="ddheader" scope="col" >Instructors</th>
+</tr>
+%(meetings)s</table>
+<br>
+<br>
+</td>
+</tr>
+'''
+
+_TEST_SCHEDULE_MEETING = '''<tr>
+<td CLASS="dddefault">Class</td>
+<td CLASS="dddefault">%s</td>
+<td CLASS="dddefault">%s</td>
+<td CLASS="dddefault">%s</td>
+<td CLASS="dddefault">Sep 07, 2011 - Dec 21, 2011</td>
+<td CLASS="dddefault">Lecture</td>
+<td CLASS="dddefault">%s (<ABBR title= "Primary">P</ABBR>)</td>
+</tr>
+'''
+
+_TEST_CATALOG_COURSE = '''<tr>
+<td CLASS="nttitle" scope="colgroup" ><a href="/ss/bwckctlg.p_disp_course_detail?cat_term_in=201110&amp;subj_code_in=%(dept)s&amp;crse_numb_in=%(number)s">%(name)s - %(title)s</a></td>
+</tr>
+<tr>
+<td CLASS="ntdefault">
+%(description)s
+<br>
+    1.000 Credit hours
+<br>
+<br>
+<SPAN class="fieldlabeltext">Course Attributes: </SPAN>
+<br>
+%(attributes)s
+<br>
+</td>
+</tr>
+'''
+
+_TEST_PAGE = '''<html><head><title>Class Schedule Listing</title></head>
+<body>
+<div class="pagebodydiv">
+<table  CLASS="datadisplaytable" SUMMARY="This layout table is used to present the sections found" WIDTH="100%%">
+<caption class="captiontext">Sections Found</caption>
+%s</table>
+<table  CLASS="plaintable" SUMMARY="This is table displays line separator at end of the page." WIDTH="100%%">
+<tr><td class="bgtabon" width="100%%" colSpan=2>&nbsp;</td></tr>
+</table>
+</div>
+</body>
+</html>
+'''
+
+def _write_test_semester(semester):
+    '''Writes the pages of a small made-up semester in the cache directory.'''
+    for dept in ('CSCI', 'MATH', 'ENGL'):
+        sections = []
+        catalog = []
+        for number in range(3):
+            name = '%s %04d' % (dept, 10 * number + 10)
+            title = 'Topics &amp; Methods %d' % number
+            catalog.append(_TEST_CATALOG_COURSE % { 'dept': dept, 'number': name[-4:], 'name': name,
+                'title': title, 'description': 'An introduction to %s.\nSecond line.' % name,
+                'attributes': 'LILE Lecture Course' if number else '' })
+            for index in range(number + 1):
+                crn = '1%s%d%d' % (len(dept) * number, number, index)
+                meetings = ''.join(_TEST_SCHEDULE_MEETING % (time, days, where, instructors)
+                    for time, days, where, instructors in [('10:00 am - 10:50 am', 'MWF', 'Salomon Center 101', 'Ann Smith'),
+                        ('1:00 pm - 2:20 pm', 'TR', 'CIT Center (Thomas Watson CIT) 368', 'Bo Li, Ann Smith')][:index + 1])
+                xlist = 'Crosslisted with ENGL 0100.<br>\n' if dept == 'ENGL' and index else ''
+                sections.append(_TEST_SCHEDULE_SECTION % { 'crn': crn, 'title': title, 'name': name + (' XLIST' if xlist else ''),
+                    'index': 'S%02d' % (index + 1), 'xlist': xlist, 'meetings': meetings })
+        _save((SCHEDULE_DATA_PATH % semester) + dept + '.html', _TEST_PAGE % ''.join(sections))
+        _save((CATALOG_DATA_PATH % semester) + dept + '.html', _TEST_PAGE % ''.join(catalog))
+        _save((EXAM_DATA_PATH % semester) + dept + ' 0010.html', '''<table>
+<tr><td class="dddefault">Exam Date</td>
+<td class="dddefault">12/%d/2011</td></tr>
+<tr><td class="dddefault">Exam Time</td>
+<td class="dddefault">9:00 AM</td></tr></table>''' % len(dept))
+
+class _TestCache(unittest.TestCase):
+    '''Runs each test in an empty temporary directory, since the cache paths are relative.'''
+
+    def setUp(self):
+        import tempfile
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+
+    def tearDown(self):
+        import shutil
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+class _Tester(_TestCache):
     def test_semester_cmp(self):
         a, b = 'Spring 2009', 'Spring 2010'
         self.assertTrue(compare_semesters(a, b) < 0 and compare_semesters(b, a) > 0)
@@ -501,8 +2818,515 @@ class _Tester(unittest.TestCase):
         a, b = 'Spring 2010', 'Spring 2010'
         self.assertTrue(compare_semesters(a, b) == 0)
 
+    def test_browser_pool(self):
+        pool = _BrowserPool()
+        b = pool.get()
+        b._history.add(None, None)
+        pool.put(b)
+        self.assertEqual(b._history._history, [])
+        self.assertTrue(pool.get() is b)
+        self.assertTrue(pool.get() is not b)
+
+    def test_parallel_parse(self):
+        _write_test_semester('Fall 2011')
+        serial = courses_to_json(sorted(parse_semester('Fall 2011'), key=lambda course: course.name))
+        self.assertEqual(serial.count('"crn"'), 15)
+        self.assertEqual(serial, courses_to_json(sorted(parse_semester('Fall 2011', jobs=2), key=lambda course: course.name)))
+
+    def test_parse_cache(self):
+        _write_test_semester('Fall 2011')
+        expected = courses_to_json(sorted(parse_semester('Fall 2011', cache=False), key=lambda course: course.name))
+        self.assertEqual(expected, courses_to_json(sorted(parse_semester('Fall 2011'), key=lambda course: course.name)))
+        _save((CATALOG_DATA_PATH % 'Fall 2011') + 'MATH.html', _TEST_PAGE % '')
+        cache = _ParseCache('Fall 2011')
+        courses = _parse_semester_catalog('Fall 2011', cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        self.assertEqual(len(courses), 6)
+        self.assertEqual(sorted(course.name for course in parse_semester('Fall 2011')),
+            ['CSCI 0010', 'CSCI 0020', 'CSCI 0030', 'ENGL 0010', 'ENGL 0020', 'ENGL 0030'])
+
+    def test_restricted_parse(self):
+        _write_test_semester('Fall 2011')
+        dump = lambda results: courses_to_json([list(x) if isinstance(x, tuple) else x for x in results])
+        for directory, parse_file in [(SCHEDULE_DATA_PATH, _parse_schedule_file), (CATALOG_DATA_PATH, _parse_catalog_file)]:
+            for filename in os.listdir(directory % 'Fall 2011'):
+                path = (directory % 'Fall 2011') + filename
+                self.assertTrue(parse_file(path))
+                self.assertEqual(dump(parse_file(path)), dump(parse_file(path, restrict=True)))
+        self.assertEqual(courses_to_json(sorted(parse_semester('Fall 2011', cache=False), key=lambda course: course.name)),
+            courses_to_json(sorted(parse_semester('Fall 2011', 2, False, True), key=lambda course: course.name)))
+
+    def test_fast_schedule_parse(self):
+        _write_test_semester('Fall 2011')
+        tricky = _TEST_PAGE % (_TEST_SCHEDULE_SECTION % { 'crn': '4242', 'title': 'Odd &amp; Ends &#8212; Part', 'name': 'ENGL 0999 XLIST',
+            'index': 'S01', 'xlist': '<!-- crosslist --> Crosslisted&nbsp;with <b>MATH 0999</b>.<br/>',
+            'meetings': '<tr><td>Class<td>TBA<td>&nbsp;<td>TBA<td>Sep 07, 2011 - Dec 21, 2011<td>Lecture<td>TBA</tr>' })
+        _save((SCHEDULE_DATA_PATH % 'Fall 2011') + 'ODD.html', tricky.replace('<head>', '<head><script>if (a < b) document.write("</td>");</script>'))
+        dump = lambda results: courses_to_json(map(list, results))
+        for filename in os.listdir(SCHEDULE_DATA_PATH % 'Fall 2011'):
+            path = (SCHEDULE_DATA_PATH % 'Fall 2011') + filename
+            self.assertTrue(_ScheduleExtractor(open(path).read()).sections)
+            self.assertEqual(dump(_parse_schedule_file(path)), dump(_ScheduleExtractor(open(path).read()).sections))
+        self.assertRaises(_FastPathError, _ScheduleExtractor, '<a href="/ss/bwckschd.p_disp_detail_sched">x - 1 - y - z</a>')
+        self.assertEqual(courses_to_json(sorted(parse_semester('Fall 2011', cache=False), key=lambda course: course.name)),
+            courses_to_json(sorted(parse_semester('Fall 2011', cache=False, fast=True, validate=True), key=lambda course: course.name)))
+
+    def test_iter_semester(self):
+        _write_test_semester('Fall 2011')
+        courses = dict((course.name, course) for course in parse_semester('Fall 2011'))
+        sections = iter_semester_sections('Fall 2011', jobs=2)
+        name, title, section = sections.next()
+        self.assertTrue(name in courses and title == courses[name].title)
+        self.assertEqual(len(list(sections)) + 1, 18)
+        self.assertEqual(sorted(courses_to_json(course) for course in iter_semester_courses('Fall 2011')),
+            sorted(courses_to_json(course) for course in _parse_semester_catalog('Fall 2011')))
+
+    def test_compact_courses(self):
+        import cPickle
+        courses = _make_test_courses(2, 3)
+        compact = compact_courses(courses)
+        self.assertFalse(hasattr(compact[0].semesters[0].sections[0].meetings[0], '__dict__'))
+        self.assertEqual(courses_to_xml(courses), courses_to_xml(compact))
+        self.assertEqual(courses_to_json(courses), courses_to_json(compact))
+        self.assertEqual(courses_to_json(courses), courses_to_json(cPickle.loads(cPickle.dumps(compact))))
+        self.assertTrue(compact[0].get_semester('Fall 2020').__class__ is CompactSemester)
+        self.assertTrue(_deep_size(compact) < _deep_size(courses))
+
+    def test_semester_index(self):
+        for course in [Course(), CompactCourse()]:
+            fall = course.get_semester('Fall 2011')
+            self.assertTrue(course.get_semester('Fall 2011') is fall)
+            spring = course.get_semester('Spring 2012')
+            self.assertEqual(course.semesters, [fall, spring])
+            course.semesters = _TrackedList([spring])
+            self.assertTrue(course.get_semester('Spring 2012') is spring)
+            self.assertTrue(course.get_semester('Fall 2011') is not fall)
+            course.semesters.pop()
+            course.semesters.extend(_make_test_courses(2, 1)[0].semesters)
+            self.assertTrue(course.get_semester('Spring 2001') is course.semesters[-1])
+            self.assertTrue(course.get_semester('Fall 2000').get_section(10001) is course.semesters[-2].sections[1])
+            self.assertTrue(course.get_semester('Fall 2000').get_section(1) is None)
+
+            # edits that keep the length of the list are noticed too
+            other = Semester()
+            other.name = 'Fall 2002'
+            replaced, course.semesters[0] = course.semesters[0], other
+            self.assertTrue(course.get_semester('Fall 2002') is other)
+            self.assertTrue(course.get_semester(replaced.name) is not replaced)
+            sections = course.semesters[2].sections
+            sections.append(sections.pop(0))
+            self.assertTrue(course.semesters[2].get_section(sections[-1].crn) is sections[-1])
+            self.assertTrue(course.semesters[2].get_section(sections[0].crn) is sections[0])
+
+            # misses on an unchanged list, and adding semesters, don't rebuild the index
+            index = _section_indices[course.semesters[2]][2]
+            self.assertTrue(course.semesters[2].get_section(1) is None)
+            self.assertTrue(_section_indices[course.semesters[2]][2] is index)
+            index = _semester_indices[course][2]
+            for year in range(2003, 2010):
+                course.get_semester('Fall %d' % year)
+            self.assertTrue(_semester_indices[course][2] is index)
+            self.assertTrue(course.get_semester('Fall 2005') is course.semesters[-5])
+        self.assertEqual(len(course.semesters), 11)
+
+        # a plain list is only checked for being replaced or changing length
+        semester = Semester()
+        semester.sections = [Section()]
+        self.assertTrue(semester.get_section(0) is semester.sections[0])
+        semester.sections.append(Section())
+        semester.sections[1].crn = 1
+        self.assertTrue(semester.get_section(1) is semester.sections[1])
+
+    def test_intern_courses(self):
+        courses = _make_test_courses(2, 3)
+        table = InternTable()
+        self.assertTrue(intern_courses(courses, table) is courses)
+        meetings = [meeting for course in courses for semester in course.semesters
+            for section in semester.sections for meeting in section.meetings]
+        self.assertTrue(meetings[0].date_range is meetings[-1].date_range)
+        self.assertEqual(table.report()['meeting.days'], 2)
+        self.assertEqual(table.report()['meeting.where'], 4)
+        text = courses_to_json(courses)
+        for compact in (False, True):
+            table = InternTable()
+            loaded = courses_from_json(text, compact, table)
+            self.assertEqual(courses_to_json(loaded), text)
+            self.assertEqual(table.report()['section.levels'], 1)
+
+    def test_meeting_times(self):
+        import datetime
+        _write_test_semester('Fall 2011')
+        meeting = parse_semester('Fall 2011')[0].semesters[0].sections[0].meetings[0]
+        self.assertEqual(meeting.date_range, 'Sep 07, 2011 - Dec 21, 2011')
+        self.assertEqual((meeting.start_date, meeting.end_date),
+            (datetime.date(2011, 9, 7).toordinal(), datetime.date(2011, 12, 21).toordinal()))
+        self.assertEqual(meeting.day_mask, _parse_days(meeting.days))
+        self.assertEqual((meeting.start_time, meeting.end_time), _parse_time(meeting.time))
+        meeting.days = meeting.time = meeting.date_range = 'TBA'
+        _set_meeting_times(meeting)
+        self.assertEqual([meeting.day_mask, meeting.start_time, meeting.end_time,
+            meeting.start_date, meeting.end_date], [0, -1, -1, -1, -1])
+
+    def test_meeting_table(self):
+        self.assertEqual(_parse_time('10:00 am - 10:50 am'), (600, 650))
+        self.assertEqual(_parse_time('12:00 pm - 1:20 pm'), (720, 800))
+        self.assertEqual(_parse_time('TBA'), (-1, -1))
+        self.assertEqual(_parse_days('MWF'), 21)
+        courses = _make_test_courses(2, 3)
+        table = MeetingTable(courses, use_numpy=False)
+        self.assertEqual(len(table), 2 * 3 * 3 * 2)
+        self.assertEqual(table.semester_names, ['Fall 2000', 'Spring 2001'])
+        i = len(table) - 1
+        meeting = courses[-1].semesters[-1].sections[-1].meetings[-1]
+        self.assertEqual(table.courses[table.course[i]], courses[-1])
+        self.assertEqual(table.crn[i], courses[-1].semesters[-1].sections[-1].crn)
+        self.assertEqual((table.days[i], table.start[i], table.end[i]), (10, 780, 860))
+        self.assertEqual(table.rooms[table.room[i]], meeting.where)
+        self.assertEqual(table.instructors[table.instructor[i]], meeting.instructors)
+
+    def test_conflicts(self):
+        courses = _make_test_courses(2, 3, 2, 1)
+        semester = courses[0].semesters[0]
+        extra = Section()
+        extra.crn = 1
+        for days, time in [('TR', '1:30 pm - 2:30 pm'), ('F', '10:50 am - 11:50 am')]:
+            meeting = Meeting()
+            meeting.days, meeting.time = days, time
+            _set_meeting_times(meeting)
+            extra.meetings.append(meeting)
+        semester.sections.append(extra)
+        conflicts = find_conflicts(courses, semester.name)
+        naive = [(a, b) for i, a in enumerate(_semester_meetings(courses, semester.name))
+            for b in _semester_meetings(courses, semester.name)[i + 1:] if a[1] != b[1] and
+            a[0].day_mask & b[0].day_mask and a[0].start_time < b[0].end_time and b[0].start_time < a[0].end_time]
+        self.assertEqual(len(conflicts), len(naive))
+        self.assertEqual(len(find_conflicts(courses, semester.name, [1, semester.sections[0].crn])), 0)
+        self.assertEqual(len(find_conflicts(courses, semester.name, [1, semester.sections[1].crn])), 1)
+        graph = conflict_graph(courses, semester.name)
+        self.assertEqual(sorted(graph[1]), sorted(section.crn for course in courses
+            for section in _find_semester(course, semester.name).sections
+            if section.crn != 1 and section.meetings[0].days == 'TR'))
+        self.assertEqual(len(graph), 3 * 2 + 1)
+
+    def test_timetables(self):
+        import itertools
+        courses = _make_test_courses(1, 4, 2, 1)
+        semester = courses[0].semesters[0]
+        lab = Section()
+        lab.crn = 1
+        meeting = Meeting()
+        meeting.type, meeting.days, meeting.time = 'Lab', 'W', '9:00 am - 9:50 am'
+        _set_meeting_times(meeting)
+        lab.meetings.append(meeting)
+        semester.sections.append(lab)
+        names = [course.name for course in courses[:2]]
+        timetables = find_timetables(courses, semester.name, names)
+        self.assertEqual(sorted(len(timetable) for timetable in timetables), [3, 3])
+        self.assertTrue(all(lab in timetable for timetable in timetables))
+        self.assertEqual(len(find_timetables(courses, semester.name, names[:1])), 2)
+        self.assertEqual(len(find_timetables(courses, semester.name, [course.name for course in courses])), 0)
+        self.assertEqual(len(find_timetables(courses, semester.name, names + ['NOPE 0000'])), 0)
+        self.assertEqual(len(find_timetables(courses, semester.name, names[1:], limit=1)), 1)
+        sections = [course.semesters[0].sections for course in courses[1:3]]
+        self.assertEqual(len(find_timetables(courses, semester.name, [course.name for course in courses[1:3]])),
+            len([x for x in itertools.product(*sections) if not find_conflicts(courses, semester.name, [y.crn for y in x])]))
+
+        # the same weekly slot in date ranges that don't overlap isn't a conflict
+        for course, date_range in zip(courses[2:4], ['Sep 07, 2011 - Oct 21, 2011', 'Oct 24, 2011 - Dec 21, 2011']):
+            for section in course.semesters[0].sections:
+                for meeting in section.meetings:
+                    meeting.date_range = date_range
+                    _set_meeting_times(meeting)
+        names = [course.name for course in courses[1:4]]
+        sections = [course.semesters[0].sections for course in courses[1:4]]
+        self.assertEqual(len(find_timetables(courses, semester.name, names)), 2)
+        self.assertEqual(len(find_timetables(courses, semester.name, names)),
+            len([x for x in itertools.product(*sections) if not find_conflicts(courses, semester.name, [y.crn for y in x])]))
+
+    def test_room_index(self):
+        courses = _make_test_courses(2, 20, 2, 1)
+        index = RoomIndex(courses, 'Fall 2000')
+        self.assertEqual(len(index.rooms()), 20)
+        self.assertEqual(index.free_rooms('T', 13 * 60, 14 * 60 + 30), [])
+        self.assertEqual(len(index.free_rooms('T', 14 * 60 + 20, 15 * 60)), 20)
+        self.assertEqual(len(index.free_rooms('MT', 9 * 60, 10 * 60 + 1)), 0)
+        self.assertEqual(len(index.free_rooms('S', 0, 24 * 60)), 20)
+        room = courses[0].semesters[0].sections[0].meetings[0].where
+        self.assertFalse(index.is_free(room, 'W', 10 * 60 + 49, 11 * 60))
+        self.assertTrue(index.is_free(room, 'W', 10 * 60 + 50, 11 * 60))
+        self.assertTrue(index.is_free('Nowhere 1', 'M', 600, 700))
+        # 3 x 50 minutes and 2 x 80 minutes in 5 days of 14 hours
+        self.assertAlmostEqual(index.utilisation()[room], 100.0 * 310 / (5 * 14 * 60))
+        self.assertAlmostEqual(index.utilisation('W', 10 * 60 + 30, 11 * 60)[room], 100.0 * 20 / 30)
+
+    def test_course_index(self):
+        courses = _make_test_courses(1, 400, 1, 1)
+        newer = _make_test_courses(2, 2, 1, 1)
+        for course in newer:
+            del course.semesters[0]
+            course.attributes = 'CBLR'
+        index = CourseIndex(courses)
+        self.assertEqual(len(index.by_instructor('Instructor 5')), 2)
+        self.assertEqual(index.by_instructor('Instructor 5'), [courses[5], courses[305]])
+        self.assertEqual(len(index.by_attribute('LILE')), 400)
+        self.assertEqual(len(index.by_department('DEPT')), 400)
+        self.assertEqual(index.by_semester('Fall 2000'), sorted(courses, key=lambda course: course.name))
+        self.assertEqual(index.sections(10003), [(courses[3], courses[3].semesters[0], courses[3].semesters[0].sections[0])])
+        self.assertEqual(index.course('NOPE 0000'), None)
+        merged = merge_courses(courses, newer)
+        index.add(newer)
+        self.assertEqual(index.by_semester('Spring 2001'), [courses[0], courses[1]])
+        self.assertEqual(index.by_attribute('CBLR'), [courses[0], courses[1]])
+        self.assertEqual(len(index.by_attribute('LILE')), 398)
+        self.assertEqual(index.sections(10003)[-1][0], courses[1])
+        index.add(merged)
+        self.assertEqual(len(index.sections(10003)), 2)
+
+    def test_search_index(self):
+        courses = _make_test_courses(1, 30, 1, 1)
+        courses[3].title = 'Introduction to Computer Science'
+        courses[4].title = 'Science of Computer Introductions'
+        courses[5].description = 'Computer science, introduction to. ' * 3
+        index = SearchIndex(courses)
+        self.assertEqual([name for name, score in index.search('computer science')], ['DEPT 0005', 'DEPT 0003', 'DEPT 0004'])
+        self.assertEqual([name for name, score in index.search('"computer science" introduction')], ['DEPT 0005', 'DEPT 0003'])
+        self.assertEqual([name for name, score in index.search('"science of computer"')], ['DEPT 0004'])
+        self.assertEqual(len(index.search('introduc*')), 3)
+        self.assertEqual(len(index.search('title 1*', limit=100)), 11)
+        self.assertEqual(index.search('lile nothing'), [])
+        self.assertEqual(SearchIndex().search('computer "computer science" comp*'), [])
+        self.assertEqual(SearchIndex([Course()]).search('computer'), [])
+        index.save('search.pickle')
+        loaded = SearchIndex.load('search.pickle')
+        self.assertEqual(loaded.search('computer science'), index.search('computer science'))
+        newer = _make_test_courses(1, 5, 1, 1)
+        newer[4].title = courses[4].title
+        loaded.add(newer)
+        self.assertEqual([name for name, score in loaded.search('computer')], ['DEPT 0005', 'DEPT 0004'])
+
+    def test_autocomplete(self):
+        courses = _make_test_courses(1, 300, 1, 1)
+        courses[7].title = 'Introduction to Computer Science'
+        courses[8].title = 'Computer Science 2'
+        autocomplete = Autocomplete(merge_courses([], courses))
+        self.assertEqual(autocomplete.complete('dept 000'), [(course.name, course.title) for course in courses[:10]])
+        self.assertEqual(len(autocomplete.complete('dept000', limit=100)), 10)
+        self.assertEqual(autocomplete.complete('DEPT 0007'), [('DEPT 0007', 'Introduction to Computer Science')])
+        self.assertEqual([name for name, title in autocomplete.complete('computer sci')], ['DEPT 0007', 'DEPT 0008'])
+        self.assertEqual([name for name, title in autocomplete.complete('Science')], ['DEPT 0007', 'DEPT 0008'])
+        self.assertEqual(len(autocomplete.complete('course title', limit=5)), 5)
+        self.assertEqual(autocomplete.complete('comp sci'), [])
+        self.assertEqual(autocomplete.complete(' '), [])
+
+    def test_courses_to_xml(self):
+        import StringIO, xml.dom.minidom
+
+        def minidom_xml(obj):
+            def helper(doc, parent, obj, name):
+                element = doc.createElement(name)
+                parent.appendChild(element)
+                if isinstance(obj, int) or isinstance(obj, float):
+                    obj = str(obj)
+                if isinstance(obj, basestring):
+                    element.appendChild(doc.createTextNode(obj))
+                elif isinstance(obj, list):
+                    for x in obj:
+                        helper(doc, element, x, _tag(x))
+                else:
+                    fields = _fields(obj)
+                    for x in fields:
+                        helper(doc, element, fields[x], x)
+            doc = xml.dom.minidom.Document()
+            helper(doc, doc, obj, 'courses')
+            return doc.toxml()
+
+        _write_test_semester('Fall 2011')
+        courses = parse_semester('Fall 2011') + _make_test_courses(2, 3)
+        courses[0].title = u'Caf\xe9 <& "Cr\xe8me" >'
+        courses[1].semesters = []
+        courses[2].description = ''
+        self.assertEqual(courses_to_xml(courses), minidom_xml(courses))
+        self.assertEqual(courses_to_xml([]), minidom_xml([]))
+        output = StringIO.StringIO()
+        write_courses_xml(compact_courses(courses), output, 'utf8')
+        self.assertEqual(output.getvalue(), minidom_xml(courses).encode('utf8'))
+
+    def test_courses_to_json(self):
+        import json, StringIO
+        _write_test_semester('Fall 2011')
+        courses = parse_semester('Fall 2011') + _make_test_courses(2, 3)
+        courses[0].title = u'Caf\xe9 <& "Cr\xe8me" > \\ \n'
+        courses[1].semesters = []
+        courses[2].description = ''
+        expected = json.dumps(_courses_to_json_helper(courses), sort_keys=True)
+        self.assertEqual(courses_to_json(courses, sort_keys=True), expected)
+        self.assertEqual(courses_to_json(courses), json.dumps(_courses_to_json_helper(courses)))
+        self.assertEqual(courses_to_json([]), '[]')
+        output = StringIO.StringIO()
+        write_courses_json(compact_courses(courses), output, True)
+        self.assertEqual(output.getvalue(), expected)
+
+    def test_export_json_lines(self):
+        import json
+        courses = _make_test_courses(2, 3, 1, 1)
+        courses[2].name = 'MATH 0002'
+        courses.append(Course())
+        courses[-1].name = 'MATH 0100'
+        manifest = export_json_lines(courses, 'out', sort_keys=True)
+        self.assertEqual([(x['path'], x['count']) for x in manifest['shards']], [('DEPT.jsonl', 2), ('MATH.jsonl', 2)])
+        self.assertEqual(json.load(open('out/manifest.json')), json.loads(json.dumps(manifest)))
+        shard = manifest['shards'][1]
+        name, offset = shard['offsets'][1]
+        data = open('out/' + shard['path'], 'rb').read()
+        self.assertEqual(len(data), shard['bytes'])
+        self.assertEqual(data[offset:].split('\n')[0], courses_to_json(courses[3], sort_keys=True))
+        for jobs in (1, 2):
+            manifest = export_json_lines(courses, 'split%d' % jobs, by_semester=True, jobs=jobs)
+        self.assertEqual([x['path'] for x in manifest['shards']], ['Fall 2000/DEPT.jsonl',
+            'Fall 2000/MATH.jsonl', 'Spring 2001/DEPT.jsonl', 'Spring 2001/MATH.jsonl'])
+        self.assertEqual(open('split1/Fall 2000/DEPT.jsonl').read(), open('split2/Fall 2000/DEPT.jsonl').read())
+        line = json.loads(open('split2/Spring 2001/MATH.jsonl').readline())
+        self.assertEqual((line['name'], [x['name'] for x in line['semesters']]), ('MATH 0002', ['Spring 2001']))
+        self.assertEqual(len(courses[2].semesters), 2)
+        expected = json.loads(courses_to_json(courses[2]))
+        expected['semesters'] = expected['semesters'][1:]
+        self.assertEqual(line, expected)
+        manifest = export_json_lines(courses, 'all', by_department=False)
+        self.assertEqual([(x['path'], x['count']) for x in manifest['shards']], [('courses.jsonl', 4)])
+
+    def test_snapshot(self):
+        _write_test_semester('Fall 2011')
+        courses = parse_semester('Fall 2011') + _make_test_courses(2, 3)
+        courses[0].title = u'Caf\xe9'
+        write_snapshot(courses, 'snapshot/courses.bin')
+        snapshot = Snapshot('snapshot/courses.bin')
+        self.assertEqual(len(snapshot), len(courses))
+        self.assertEqual(courses_to_json(snapshot.courses()), courses_to_json(courses))
+        for course in courses:
+            self.assertEqual(courses_to_json(snapshot.course(course.name)), courses_to_json(course))
+        self.assertEqual(snapshot.course(u'NOPE 0000'), None)
+        self.assertEqual(snapshot.course('ZZZZ 9999'), None)
+        section = courses[-1].semesters[-1].sections[-1]
+        [(course, semester, found)] = snapshot.sections(section.crn)
+        self.assertEqual((course.name, semester.name), (courses[-1].name, courses[-1].semesters[-1].name))
+        self.assertEqual(courses_to_json(found), courses_to_json(section))
+        self.assertEqual(snapshot.sections(-1), [])
+        snapshot.close()
+        write_snapshot([], 'snapshot/empty.bin')
+        self.assertEqual(Snapshot('snapshot/empty.bin').courses(), [])
+
+    def test_run_threads(self):
+        done = []
+
+        def fail():
+            raise IOError('department failed')
+        self.assertRaises(IOError, _run_threads, [lambda: done.append(1), fail, lambda: done.append(2)])
+        self.assertEqual(sorted(done), [1, 2])
+
+    def test_crawler(self):
+        import BaseHTTPServer, SocketServer, threading
+
+        def form(action, name, options, extra=''):
+            return '<form action="%s" method="post">%s<select name="%s">%s</select>' \
+                '<input type="submit" value="Submit"></form>' % (action, extra, name,
+                ''.join('<option value="%s">%s</option>' % x for x in options))
+
+        def department(kind, code):
+            if kind == 'catalog':
+                return '<a href="/ss/bwckctlg.p_disp_course_detail?c=%s">%s 0010 - Intro</a>' % (code, code)
+            return ''.join('<a href="/ss/bwckschd.p_disp_detail_sched?crn=%s%d">Intro - %s%d - %s 0010 - S0%d</a>' %
+                (code, i, code, i, code, i) for i in range(3))
+
+        pages = {}
+        for kind in ('schedule', 'catalog'):
+            pages['/' + kind] = form('/%s/term' % kind, 'p_term', [('201110', 'Fall 2011'), ('201120', 'Spring 2012')])
+            pages['/%s/term?p_term=201110' % kind] = form('/%s/detail' % kind, 'sel_subj', [('CSCI', 'Computer Science'),
+                ('MATH', 'Mathematics')], '<input type="hidden" name="term_in" value="201110">')
+            for code in ('CSCI', 'MATH'):
+                pages['/%s/detail?term_in=201110&sel_subj=%s' % (kind, code)] = department(kind, code)
+        for code in ('CSCI', 'MATH'):
+            for i in range(3):
+                pages['/ss/bwckschd.p_disp_detail_sched?crn=%s%d' % (code, i)] = \
+                    '<a href="/exam/Display_Exam?crn=%s%d">exam</a>' % (code, i)
+                pages['/exam/Display_Exam?crn=%s%d' % (code, i)] = BAD_EXAM_INFO if code == 'MATH' or i == 0 else \
+                    '<td>Exam Date</td><td>12/15</td><td>Exam Time</td><td>9:00</td>'
+        requests = []
+        not_modified = []
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self, path=None):
+                path = path or self.path
+                requests.append(path)
+                etag = '"%d"' % len(pages.get(path, ''))
+                if path.startswith('/exam/') and self.headers.get('If-None-Match') == etag:
+                    not_modified.append(path)
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200 if path in pages else 404)
+                self.send_header('Set-Cookie', 'session=1')
+                if path.startswith('/exam/'):
+                    self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(pages.get(path, ''))
+
+            def do_POST(self):
+                self.do_GET(self.path + '?' + self.rfile.read(int(self.headers['Content-Length'])))
+
+            def log_message(self, *args):
+                pass
+
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+
+        server = Server(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever).start()
+        url = 'http://127.0.0.1:%d' % server.server_port
+        try:
+            _crawl_semester('Fall 2011', _Manifest('Fall 2011'), url + '/schedule', url + '/catalog', 4)
+            self.assertEqual(sorted(os.listdir(SCHEDULE_DATA_PATH % 'Fall 2011')), ['CSCI.html', 'MATH.html'])
+            self.assertEqual(sorted(os.listdir(CATALOG_DATA_PATH % 'Fall 2011')), ['CSCI.html', 'MATH.html'])
+            self.assertEqual(os.listdir(EXAM_DATA_PATH % 'Fall 2011'), ['CSCI 0010.html'])
+            self.assertTrue('/ss/bwckschd.p_disp_detail_sched?crn=CSCI2' not in requests)
+
+            # resuming only fetches the pages that lead to the department lists
+            os.remove((CATALOG_DATA_PATH % 'Fall 2011') + 'MATH.html')
+            del requests[:]
+            _crawl_semester('Fall 2011', _Manifest('Fall 2011', resume=True), url + '/schedule', url + '/catalog', 4)
+            self.assertEqual(sorted(requests), ['/catalog', '/catalog/detail?term_in=201110&sel_subj=MATH',
+                '/catalog/term?p_term=201110', '/schedule', '/schedule/term?p_term=201110'])
+
+            # an incremental download finds nothing changed, except for a changed page
+            pages['/catalog/detail?term_in=201110&sel_subj=CSCI'] += ' '
+            manifest = _Manifest('Fall 2011', incremental=True)
+            _crawl_semester('Fall 2011', manifest, url + '/schedule', url + '/catalog', 4)
+            self.assertEqual(manifest.changed, [(CATALOG_DATA_PATH % 'Fall 2011') + 'CSCI.html'])
+            self.assertEqual(not_modified, ['/exam/Display_Exam?crn=CSCI1'])
+            self.assertEqual(os.listdir(EXAM_DATA_PATH % 'Fall 2011'), ['CSCI 0010.html'])
+
+            # the 304 had no ETag, so the one from before is used again
+            manifest = _Manifest('Fall 2011', incremental=True)
+            _crawl_semester('Fall 2011', manifest, url + '/schedule', url + '/catalog', 4)
+            self.assertEqual(manifest.changed, [])
+            self.assertEqual(not_modified, ['/exam/Display_Exam?crn=CSCI1'] * 2)
+
+            # failed pages are marked as such and the other sections of the course are still tried
+            del pages['/ss/bwckschd.p_disp_detail_sched?crn=CSCI0']
+            del pages['/catalog/detail?term_in=201110&sel_subj=MATH']
+            del requests[:]
+            manifest = _Manifest('Fall 2011')
+            self.assertEqual(_crawl_semester('Fall 2011', manifest, url + '/schedule', url + '/catalog', 4), 2)
+            self.assertTrue('/ss/bwckschd.p_disp_detail_sched?crn=CSCI1' in requests)
+            self.assertEqual(manifest.entries['section/CSCI0']['status'], 'failed')
+            self.assertEqual(manifest.entries['catalog/MATH']['status'], 'failed')
+            self.assertEqual(manifest.entries['exam/CSCI 0010']['status'], 'done')
+        finally:
+            server.shutdown()
+
 if __name__ == '__main__':
     import sys
     if 'test' in sys.argv:
         sys.argv.remove('test')
         unittest.main()
+    elif 'benchmark' in sys.argv:
+        benchmark_memory()
@@ -22,7 +22,7 @@ def parse_and_save_semesters(semesters):
 def merge_semesters(semesters):
     courses = []
     for semester in sorted(semesters, banner.compare_semesters):
-        new_courses = pickle.loads(open(path_for_semester(semester)).read())
+        new_courses = banner.intern_courses(pickle.loads(open(path_for_semester(semester)).read()))
         courses = banner.merge_courses(courses, new_courses)
     return courses
 
@@ -30,8 +30,9 @@ def gen_quick_downloads():
     download_semesters(semesters)
     parse_and_save_semesters(semesters)
     courses = merge_semesters(semesters)
-    open('banner.xml', 'w').write(banner.courses_to_xml(courses).encode('utf8'))
-    open('banner.json', 'w').write(banner.courses_to_json(courses).encode('utf8'))
+    banner.write_courses_xml(courses, open('banner.xml', 'w'), 'utf8')
+    banner.write_courses_json(courses, open('banner.json', 'w'))
+    banner.export_json_lines(courses, 'banner-jsonl', by_semester=True)
     open('banner.pickle', 'w').write(courses_to_pickle(courses))
 
 def courses_to_pickle(courses):
@@ -48,12 +49,13 @@ def courses_to_pickle(courses):
         elif isinstance(obj, list):
             return [conversion_helper(x) for x in obj]
         else:
-            if isinstance(obj, banner.Course): new_obj = Course()
-            elif isinstance(obj, banner.Semester): new_obj = Semester()
-            elif isinstance(obj, banner.Section): new_obj = Section()
-            elif isinstance(obj, banner.Meeting): new_obj = Meeting()
+            if isinstance(obj, (banner.Course, banner.CompactCourse)): new_obj = Course()
+            elif isinstance(obj, (banner.Semester, banner.CompactSemester)): new_obj = Semester()
+            elif isinstance(obj, (banner.Section, banner.CompactSection)): new_obj = Section()
+            elif isinstance(obj, (banner.Meeting, banner.CompactMeeting)): new_obj = Meeting()
             else: raise Exception('attempt to pickle object of type %s' % obj.__class__.__name__)
-            new_obj.__dict__ = dict((x, conversion_helper(obj.__dict__[x])) for x in obj.__dict__)
+            fields = banner._fields(obj)
+            new_obj.__dict__ = dict((x, conversion_helper(fields[x])) for x in fields)
             return new_obj
 
     return pickle.dumps(conversion_helper(courses))